@@ -1,8 +1,20 @@
 # Import the API that we want to expose here
 
+from .aio import alock  # noqa
 from .kinds import LOCK_KINDS  # noqa
 from .lock import (   # noqa
     lock,
+    lock_many,
     Lock,
     LockAcquisitionError,
 )
+from .rwlock import (  # noqa
+    read_lock,
+    write_lock,
+    ReadWriteLock,
+)
+from .semaphore import (  # noqa
+    semaphore,
+    Semaphore,
+)
+from .singleflight import singleflight  # noqa
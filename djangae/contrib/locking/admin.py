@@ -1,7 +1,46 @@
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
 
-
+from .metrics import stats
 from .models import DatastoreLock
 
 
-admin.site.register(DatastoreLock)
+class DatastoreLockAdmin(admin.ModelAdmin):
+    list_display = ("identifier", "timestamp", "expires")
+    search_fields = ("identifier",)
+
+    def get_urls(self):
+        return [
+            path(
+                "stats/",
+                self.admin_site.admin_view(self.stats_view),
+                name="locking_datastorelock_stats",
+            ),
+        ] + super().get_urls()
+
+    def stats_view(self, request):
+        """ Summary of the locks (grouped by identifier prefix) which have been waited on the most. """
+        columns = (
+            "kind", "prefix", "acquisitions", "attempts", "failures", "steals",
+            "total_wait_ms", "max_wait_ms", "total_hold_ms", "max_hold_ms",
+        )
+        rows = [
+            [
+                round(row.get(column, 0)) if isinstance(row.get(column, 0), float) else row.get(column, 0)
+                for column in columns
+            ]
+            for row in stats.hottest()
+        ]
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title="Hottest locks",
+            opts=self.model._meta,
+            columns=columns,
+            rows=rows,
+        )
+        return TemplateResponse(request, "admin/locking/datastorelock/stats.html", context)
+
+
+admin.site.register(DatastoreLock, DatastoreLockAdmin)
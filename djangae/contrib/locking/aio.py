@@ -0,0 +1,109 @@
+# STANDARD LIB
+import asyncio
+import time
+
+# DJANGAE
+from djangae.processing import closing_connections
+from .backoff import start_backoff
+from .kinds import LOCK_KINDS
+from .lock import (
+    Lock,
+    LockAcquisitionError,
+)
+from .metrics import stats as lock_stats
+
+
+def _run_in_executor(function, *args, **kwargs):
+    """ Runs `function` on the event loop's default executor, returning an awaitable. """
+    run = closing_connections(lambda: function(*args, **kwargs))
+    return asyncio.get_event_loop().run_in_executor(None, run)
+
+
+async def acquire_async(
+    identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None, backoff=None,
+    lease_ms=None
+):
+    """ The same as `Lock.acquire`, but for use from async code. Each attempt to acquire the lock
+        (a Datastore transaction or cache operation) runs on the event loop's default executor,
+        and the backoff between attempts uses `asyncio.sleep`, so the event loop is never blocked.
+    """
+    start = time.time()
+    attempts = 0
+    acquisition = {}
+
+    backoff = start_backoff(backoff, max_wait_ms)
+
+    while True:
+        lock = await _run_in_executor(
+            Lock._acquire_remote, identifier, wait=False, steal_after_ms=steal_after_ms, kind=kind,
+            backoff=None, lease_ms=lease_ms, stats=acquisition
+        )
+        attempts += acquisition["attempts"]
+
+        if lock is not None:
+            break
+
+        if not wait or not await backoff.wait_async():
+            lock_stats.failed(identifier, kind, (time.time() - start) * 1000, attempts)
+            return None
+
+    lock_stats.acquired(identifier, kind, (time.time() - start) * 1000, attempts, acquisition["stolen"])
+
+    instance = Lock._wrap(lock, identifier, kind, lease_ms)
+    instance._acquired_at = time.time()
+    return instance
+
+
+async def release_async(lock):
+    """ Release a lock acquired with `acquire_async` without blocking the event loop. """
+    await _run_in_executor(lock.release)
+
+
+class AsyncLocknessMonster(object):
+    """ Async context manager for locking a block of code in async views, e.g.
+
+        async with alock("my_lock"):
+            ...
+
+        Arguments are the same as for `lock`. LockAcquisitionError is raised if the lock can't
+        be acquired.
+    """
+
+    def __init__(
+        self, identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None,
+        backoff=None, lease_ms=None, heartbeat=False
+    ):
+        if heartbeat and not lease_ms:
+            raise ValueError("heartbeat requires a lease_ms")
+
+        self.identifier = identifier
+        self.wait = wait
+        self.steal_after_ms = steal_after_ms
+        self.kind = kind
+        self.max_wait_ms = max_wait_ms
+        self.backoff = backoff
+        self.lease_ms = lease_ms
+        self.heartbeat = heartbeat
+        self.lock = None
+
+    async def __aenter__(self):
+        self.lock = await acquire_async(
+            self.identifier, self.wait, self.steal_after_ms, self.kind,
+            max_wait_ms=self.max_wait_ms,
+            backoff=self.backoff,
+            lease_ms=self.lease_ms,
+        )
+        if self.lock is None:
+            raise LockAcquisitionError("Failed to acquire lock for '%s'" % (self.identifier,))
+
+        if self.heartbeat:
+            # The heartbeat runs in its own thread, so doesn't block the event loop
+            self.lock.start_heartbeat()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self.lock:
+            await release_async(self.lock)
+            self.lock = None  # Just for neatness
+
+
+alock = AsyncLocknessMonster
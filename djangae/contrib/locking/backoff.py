@@ -0,0 +1,94 @@
+# STANDARD LIB
+import asyncio
+import random
+import time
+
+
+DEFAULT_INITIAL_BACKOFF_MS = 10
+DEFAULT_MAX_BACKOFF_MS = 1000
+
+
+def _sleep(seconds):  # Patchable
+    time.sleep(seconds)
+
+
+class Backoff(object):
+    """ Exponential backoff with decorrelated jitter for waiting between lock acquisition attempts.
+        Each wait is a random time between `initial_ms` and 3 times the previous wait, capped at
+        `max_ms` and at whatever remains of `max_wait_ms` (if passed).
+        If `fast_first_retry` is True then the first retry happens immediately, which is useful when
+        the first attempt is likely to have failed due to a collision rather than a held lock.
+        A Backoff passed to the locking functions (e.g. `lock("x", backoff=Backoff(initial_ms=50))`)
+        is used as a template: each acquisition waits with a fresh copy of it (see `start_backoff`).
+    """
+
+    def __init__(
+        self, initial_ms=DEFAULT_INITIAL_BACKOFF_MS, max_ms=DEFAULT_MAX_BACKOFF_MS, fast_first_retry=False,
+        max_wait_ms=None
+    ):
+        self.initial_ms = initial_ms
+        self.max_ms = max(max_ms, initial_ms)
+        self.fast_first_retry = fast_first_retry
+        self.max_wait_ms = max_wait_ms
+        self.attempts = 0
+        self._previous_ms = initial_ms
+        self._start = time.time()
+
+    def started(self, max_wait_ms=None):
+        """ Returns a copy of this Backoff which starts timing from now, and is limited to
+            `max_wait_ms` if passed (otherwise to this Backoff's `max_wait_ms`).
+        """
+        return Backoff(
+            initial_ms=self.initial_ms,
+            max_ms=self.max_ms,
+            fast_first_retry=self.fast_first_retry,
+            max_wait_ms=self.max_wait_ms if max_wait_ms is None else max_wait_ms,
+        )
+
+    def elapsed_ms(self):
+        return (time.time() - self._start) * 1000
+
+    def remaining_ms(self):
+        """ Returns how much of `max_wait_ms` remains, or None if there is no limit. """
+        if self.max_wait_ms is None:
+            return None
+        return max(0, self.max_wait_ms - self.elapsed_ms())
+
+    def next_ms(self):
+        """ Returns the time to wait before the next attempt. """
+        self.attempts += 1
+        if self.attempts == 1 and self.fast_first_retry:
+            delay = 0
+        else:
+            delay = min(self.max_ms, random.uniform(self.initial_ms, self._previous_ms * 3))
+            self._previous_ms = delay
+
+        remaining = self.remaining_ms()
+        if remaining is not None:
+            delay = min(delay, remaining)
+        return delay
+
+    def wait(self):
+        """ Sleeps before the next attempt. Returns False (without sleeping) if `max_wait_ms` has
+            already elapsed.
+        """
+        if self.remaining_ms() == 0:
+            return False
+
+        _sleep(self.next_ms() / 1000.0)
+        return True
+
+    async def wait_async(self):
+        """ The same as `wait`, but sleeps with `asyncio.sleep` so as not to block the event loop. """
+        if self.remaining_ms() == 0:
+            return False
+
+        await asyncio.sleep(self.next_ms() / 1000.0)
+        return True
+
+
+def start_backoff(backoff=None, max_wait_ms=None):
+    """ Returns the Backoff for a single acquisition, using the settings of `backoff` (or the
+        defaults) and limited to `max_wait_ms`.
+    """
+    return (backoff or Backoff()).started(max_wait_ms)
@@ -0,0 +1,45 @@
+# STANDARD LIB
+import logging
+import threading
+
+# DJANGAE
+from djangae.processing import close_thread_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class Heartbeat(threading.Thread):
+    """ Background thread which renews the lease on a lock every `interval_ms` until stopped,
+        or until the lock is lost (e.g. because a renewal came too late and another thread took
+        over the lock).
+    """
+
+    def __init__(self, lock, interval_ms):
+        super().__init__(name="Heartbeat for %r" % lock)
+        self.daemon = True
+        self.lock = lock
+        self.interval_ms = interval_ms
+        self.lost = False
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stopped.wait(self.interval_ms / 1000.0):
+                try:
+                    renewed = self.lock.renew()
+                except Exception:
+                    logger.exception("Error renewing the lease on %r, will retry", self.lock)
+                    continue
+
+                if not renewed:
+                    logger.warning("Lost the lease on %r", self.lock)
+                    self.lost = True
+                    break
+        finally:
+            close_thread_connections()
+
+    def stop(self):
+        self._stopped.set()
+        if self is not threading.current_thread():
+            self.join()
@@ -0,0 +1,60 @@
+# STANDARD LIB
+import threading
+
+
+# (kind, identifier) -> [threading.Lock, number of threads holding or waiting for it]
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def _checkout(key):
+    with _local_locks_guard:
+        entry = _local_locks.get(key)
+        if entry is None:
+            entry = _local_locks[key] = [threading.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _checkin(key):
+    with _local_locks_guard:
+        entry = _local_locks[key]
+        entry[1] -= 1
+        if not entry[1]:
+            # Nobody else is interested in this lock, so don't keep it around
+            del _local_locks[key]
+
+
+class LocalLock(object):
+    """ An in-process lock, which threads pass through before competing for a lock with other
+        instances. This means only one thread per process runs transactions (or cache operations)
+        for a given lock at a time, and the others queue locally.
+    """
+
+    def __init__(self, key, lock):
+        self.key = key
+        self._lock = lock
+
+    @classmethod
+    def acquire(cls, key, wait=True, timeout_ms=None):
+        """ Returns a LocalLock, or None if `wait` is False and the lock is held by another thread,
+            or if `timeout_ms` passes before the lock is available.
+        """
+        lock = _checkout(key)
+
+        if not wait:
+            acquired = lock.acquire(False)
+        elif timeout_ms is None:
+            acquired = lock.acquire()
+        else:
+            acquired = lock.acquire(timeout=timeout_ms / 1000.0)
+
+        if not acquired:
+            _checkin(key)
+            return None
+
+        return cls(key, lock)
+
+    def release(self):
+        self._lock.release()
+        _checkin(self.key)
@@ -1,15 +1,36 @@
 # STANDARD LIB
+import time
 from functools import wraps
 
 # DJANGAE
+from .backoff import start_backoff
+from .heartbeat import Heartbeat
 from .kinds import LOCK_KINDS
+from .local import LocalLock
 from .memcache import MemcacheLock
+from .metrics import stats as lock_stats
 
 
 class LockAcquisitionError(Exception):
     pass
 
 
+class _LockSet(object):
+    """ Wraps several underlying locks of the same kind so that they can be renewed and released
+        together.
+    """
+
+    def __init__(self, locks, release_many):
+        self.locks = locks
+        self._release_many = release_many
+
+    def renew(self, lease_ms):
+        return all([lock.renew(lease_ms) for lock in self.locks])
+
+    def release(self):
+        self._release_many(self.locks)
+
+
 class Lock(object):
     """ Common interface for acquiring and releasing a lock of the given kind.
         This is a lower-level interface than the `lock` decorator/context manager for cases where
@@ -20,34 +41,184 @@ class Lock(object):
         return u"<Lock (%s) '%s'>" % (self._kind, self._identifier)
 
     @classmethod
-    def acquire(cls, identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None):
+    def acquire(
+        cls, identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None,
+        backoff=None, lease_ms=None, local=False
+    ):
+        """ Acquire the lock with the given `identifier`, returning a `Lock` or None.
+            `backoff` is a `Backoff` with the settings to wait with between attempts.
+            If `local` is True then threads in this process queue for an in-process lock first, so
+            that only one of them at a time competes with other instances. Locks which are never
+            released will then block other threads in this process until `steal_after_ms` or
+            `lease_ms` has passed (rather than until the lock is cleaned up).
+            Acquisitions are recorded in `djangae.contrib.locking.metrics`.
+        """
+        start = time.time()
+        acquisition = {"attempts": 0, "stolen": False}
+        # This is started now, so any time spent waiting for the local lock counts towards max_wait_ms
+        backoff = start_backoff(backoff, max_wait_ms)
+
+        local_lock = None
+        if local:
+            local_lock = cls._acquire_local(identifier, kind, wait, steal_after_ms, max_wait_ms, lease_ms)
+            if local_lock is False:
+                lock_stats.failed(identifier, kind, (time.time() - start) * 1000, 0)
+                return None
+
+        try:
+            lock = cls._acquire_remote(
+                identifier, wait=wait, steal_after_ms=steal_after_ms, kind=kind, backoff=backoff,
+                lease_ms=lease_ms, stats=acquisition
+            )
+        except:  # noqa
+            if local_lock:
+                local_lock.release()
+            raise
+
+        wait_ms = (time.time() - start) * 1000
+        if lock is None:
+            if local_lock:
+                local_lock.release()
+            lock_stats.failed(identifier, kind, wait_ms, acquisition["attempts"])
+            return None
+
+        lock_stats.acquired(identifier, kind, wait_ms, acquisition["attempts"], acquisition["stolen"])
+
+        instance = cls._wrap(lock, identifier, kind, lease_ms)
+        instance._local_lock = local_lock
+        instance._acquired_at = time.time()
+        return instance
+
+    @classmethod
+    def _acquire_local(cls, identifier, kind, wait, steal_after_ms, max_wait_ms, lease_ms):
+        """ Returns a LocalLock, False if the lock can't be acquired, or None if we should skip the
+            local lock and go straight to competing for the lock with other instances.
+        """
+        # Another thread in this process might have held the lock for long enough that we're allowed
+        # to steal it, or its lease might have expired. We can't tell, so only wait locally for that
+        # long before competing for the lock anyway
+        takeover_ms = min([x for x in (steal_after_ms, lease_ms) if x is not None] or [None])
+
+        if not wait:
+            local_lock = LocalLock.acquire((kind, identifier), wait=False)
+            if local_lock is None and takeover_ms is None:
+                return False
+            return local_lock
+
+        timeouts = [x for x in (max_wait_ms, takeover_ms) if x is not None]
+        local_lock = LocalLock.acquire((kind, identifier), timeout_ms=min(timeouts) if timeouts else None)
+        if local_lock is None and (takeover_ms is None or (max_wait_ms is not None and max_wait_ms <= takeover_ms)):
+            # We ran out of time
+            return False
+        return local_lock
+
+    @classmethod
+    def _acquire_remote(cls, identifier, wait, steal_after_ms, kind, backoff, lease_ms, stats):
+        kwargs = dict(wait=wait, steal_after_ms=steal_after_ms, backoff=backoff, lease_ms=lease_ms, stats=stats)
+
         if kind == LOCK_KINDS.STRONG:
             from .models import DatastoreLock  # Avoid importing models before they're ready
-            lock = DatastoreLock.objects.acquire(
-                identifier, wait=wait, steal_after_ms=steal_after_ms, max_wait_ms=max_wait_ms
-            )
+            return DatastoreLock.objects.acquire(identifier, **kwargs)
         elif kind == LOCK_KINDS.WEAK:
-            if max_wait_ms is not None:
-                raise NotImplementedError("max_wait_ms is not implemented for WEAK locks")
+            return MemcacheLock.acquire(identifier, **kwargs)
+        else:
+            raise Exception("Unsupported kind")
 
-            lock = MemcacheLock.acquire(
-                identifier, wait=wait, steal_after_ms=steal_after_ms
-            )
+    @classmethod
+    def acquire_many(
+        cls, identifiers, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None,
+        backoff=None, lease_ms=None
+    ):
+        """ Acquires the locks for all of the given identifiers, or none of them. Returns a single
+            `Lock` which releases all of them, or None.
+            Locks are acquired in a canonical order to avoid deadlocks. STRONG locks are all acquired
+            in a single transaction.
+            Acquisitions are recorded in `djangae.contrib.locking.metrics` for each identifier.
+        """
+        start = time.time()
+        acquisition = {"attempts": 0, "stolen": False}
+
+        kwargs = dict(
+            wait=wait, steal_after_ms=steal_after_ms, backoff=start_backoff(backoff, max_wait_ms),
+            lease_ms=lease_ms, stats=acquisition
+        )
+
+        if kind == LOCK_KINDS.STRONG:
+            from .models import DatastoreLock  # Avoid importing models before they're ready
+            locks = DatastoreLock.objects.acquire_many(identifiers, **kwargs)
+            release_many = DatastoreLock.objects.release_many
+        elif kind == LOCK_KINDS.WEAK:
+            locks = MemcacheLock.acquire_many(identifiers, **kwargs)
+            release_many = MemcacheLock.release_many
         else:
             raise Exception("Unsupported kind")
 
-        if lock is None:
+        wait_ms = (time.time() - start) * 1000
+        if locks is None:
+            for identifier in set(identifiers):
+                lock_stats.failed(identifier, kind, wait_ms, acquisition["attempts"])
             return None
 
+        for identifier in set(identifiers):
+            lock_stats.acquired(identifier, kind, wait_ms, acquisition["attempts"], acquisition["stolen"])
+
+        instance = cls._wrap(_LockSet(locks, release_many), tuple(identifiers), kind, lease_ms)
+        instance._acquired_at = time.time()
+        return instance
+
+    @classmethod
+    def _wrap(cls, lock, identifier, kind, lease_ms):
         instance = cls()
         instance._lock = lock
         # These two attributes are stored only for the benefit of the __repr__ method
         instance._identifier = identifier
         instance._kind = kind
+        instance._lease_ms = lease_ms
+        instance._heartbeat = None
+        instance._local_lock = None
+        instance._acquired_at = None
         return instance
 
+    def renew(self, lease_ms=None):
+        """ Extends the lease on the lock by `lease_ms` (defaults to the lease it was acquired
+            with) from now. Returns False if the lock has been lost.
+        """
+        lease_ms = lease_ms or self._lease_ms
+        if not lease_ms:
+            raise ValueError("Only locks acquired with a lease_ms can be renewed")
+
+        return self._lock.renew(lease_ms)
+
+    def start_heartbeat(self, interval_ms=None):
+        """ Starts a background thread which renews the lease on the lock every `interval_ms`
+            (defaults to a third of the lease) until the lock is released.
+        """
+        if not self._lease_ms:
+            raise ValueError("Only locks acquired with a lease_ms can have a heartbeat")
+
+        if self._heartbeat is None:
+            self._heartbeat = Heartbeat(self, interval_ms or self._lease_ms / 3.0)
+            self._heartbeat.start()
+
     def release(self):
-        self._lock.release()
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+            self._heartbeat = None
+
+        try:
+            self._lock.release()
+        finally:
+            if self._local_lock:
+                self._local_lock.release()
+                self._local_lock = None
+
+        if self._acquired_at is not None:
+            hold_ms = (time.time() - self._acquired_at) * 1000
+            # Locks from acquire_many are recorded against each of their identifiers
+            identifiers = self._identifier if isinstance(self._identifier, tuple) else (self._identifier,)
+            for identifier in set(identifiers):
+                lock_stats.released(identifier, self._kind, hold_ms)
+            self._acquired_at = None
 
 
 class LocknessMonster(object):
@@ -60,13 +231,29 @@ class LocknessMonster(object):
             If used as a context manager, LockAcquisitionError will be raised when entering `with`.
         If `steal_after_ms` is passed then existing locks on this function which are older
         than this value will be ignored.
+        `backoff` is a `Backoff` with the settings to wait with between attempts to acquire the lock.
+        If `lease_ms` is passed then the lock expires this long after it's acquired, so that other
+        threads can take over if this one dies. If `heartbeat` is True then the lease is renewed in
+        the background while the function or block of code runs.
+        If `local` is True then threads in this process queue for the lock locally before competing
+        for it with other instances (see `Lock.acquire`).
     """
 
-    def __init__(self, identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG):
+    def __init__(
+        self, identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, backoff=None,
+        lease_ms=None, heartbeat=False, local=False
+    ):
+        if heartbeat and not lease_ms:
+            raise ValueError("heartbeat requires a lease_ms")
+
         self.identifier = identifier
         self.wait = wait
         self.steal_after_ms = steal_after_ms
         self.kind = kind
+        self.backoff = backoff
+        self.lease_ms = lease_ms
+        self.heartbeat = heartbeat
+        self.local = local
 
     def __call__(self, function):
         @wraps(function)
@@ -80,10 +267,21 @@ class LocknessMonster(object):
                 return  # Do not run the function
         return replacement_function
 
+    def _acquire(self):
+        return Lock.acquire(
+            self.identifier, self.wait, self.steal_after_ms, self.kind,
+            backoff=self.backoff,
+            lease_ms=self.lease_ms,
+            local=self.local,
+        )
+
     def __enter__(self):
-        self.lock = Lock.acquire(self.identifier, self.wait, self.steal_after_ms, self.kind)
+        self.lock = self._acquire()
         if self.lock is None:
-            raise LockAcquisitionError("Failed to acquire lock for '%s'" % self.identifier)
+            raise LockAcquisitionError("Failed to acquire lock for '%s'" % (self.identifier,))
+
+        if self.heartbeat:
+            self.lock.start_heartbeat()
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.lock:
@@ -91,4 +289,23 @@ class LocknessMonster(object):
             self.lock = None  # Just for neatness
 
 
+class LocknessMonsters(LocknessMonster):
+    """ The same as `lock`, but takes a list of identifiers and acquires all of the locks (using
+        `Lock.acquire_many`) before running the function or block of code.
+    """
+
+    def __init__(self, identifiers, *args, **kwargs):
+        super().__init__(tuple(identifiers), *args, **kwargs)
+        if self.local:
+            raise ValueError("local is not supported when acquiring many locks")
+
+    def _acquire(self):
+        return Lock.acquire_many(
+            self.identifier, self.wait, self.steal_after_ms, self.kind,
+            backoff=self.backoff,
+            lease_ms=self.lease_ms,
+        )
+
+
 lock = LocknessMonster
+lock_many = LocknessMonsters
@@ -1,40 +1,174 @@
-import random
+import hashlib
+import math
 import time
-from datetime import datetime
+import uuid
 
 from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from .backoff import start_backoff
+
+# How long to keep the marker which stops more than one thread stealing the same stale lock
+STEAL_MARKER_TIMEOUT = 60
+
+
+def _lease_timeout(lease_ms):
+    """ Returns the cache timeout for a lock with the given lease. Leases are rounded up to whole
+        seconds, as memcached truncates timeouts to seconds (and treats 0 as never expiring).
+    """
+    return DEFAULT_TIMEOUT if lease_ms is None else max(1, int(math.ceil(lease_ms / 1000.0)))
 
 
 class MemcacheLock(object):
-    def __init__(self, identifier, cache, unique_value):
+    def __init__(self, identifier, cache, unique_value, lease_ms=None):
         self.identifier = identifier
         self._cache = cache
         self.unique_value = unique_value
+        self.lease_ms = lease_ms
+
+    @classmethod
+    def _steal(cls, identifier, unique_value, steal_after_ms, lease_ms=None):
+        """ Replace the existing lock with our own if it's older than `steal_after_ms`. Only
+            one thread can steal any given lock, so returns False if another thread got there first.
+        """
+        current = cache.get(identifier)
+        try:
+            current_value, timestamp = current
+        except (TypeError, ValueError):
+            # Lock was released in the meantime, or it's not in a format we understand
+            return False
+
+        if (time.time() - timestamp) * 1000 <= steal_after_ms:
+            return False
+
+        if not cache.add("%s:steal:%s" % (identifier, current_value), True, STEAL_MARKER_TIMEOUT):
+            # Someone else is stealing this lock
+            return False
+
+        # Make sure the lock wasn't released (and acquired by someone else) while we were deciding
+        if cache.get(identifier) != current:
+            return False
+
+        cache.set(identifier, (unique_value, time.time()), _lease_timeout(lease_ms))
+        return True
 
     @classmethod
-    def acquire(cls, identifier, wait=True, steal_after_ms=None):
-        start_time = datetime.utcnow()
-        unique_value = random.randint(1, 100000)
+    def acquire(
+        cls, identifier, wait=True, steal_after_ms=None, max_wait_ms=None, backoff=None, lease_ms=None,
+        stats=None
+    ):
+        """ Acquire the lock with the given `identifier`, see `LockQuerySet.acquire` for the arguments.
+            If `lease_ms` is passed then the lock expires from the cache after this long unless it's
+            renewed with `renew`.
+        """
+        unique_value = uuid.uuid4().hex
+
+        if backoff is None:
+            backoff = start_backoff(max_wait_ms=max_wait_ms)
+
+        if stats is None:
+            stats = {}
+        stats.update(attempts=0, stolen=False)
 
         while True:
-            acquired = cache.add(identifier, unique_value)
+            stats["attempts"] += 1
+
+            # We store the time the lock was taken so that waiting threads can tell
+            # whether it's old enough to steal
+            acquired = cache.add(identifier, (unique_value, time.time()), _lease_timeout(lease_ms))
             if acquired:
-                return cls(identifier, cache, unique_value)
-            elif not wait:
+                return cls(identifier, cache, unique_value, lease_ms)
+
+            if steal_after_ms is not None and cls._steal(identifier, unique_value, steal_after_ms, lease_ms):
+                stats["stolen"] = True
+                return cls(identifier, cache, unique_value, lease_ms)
+
+            # Back off before trying again, unless we're not waiting or have waited long enough
+            if not wait or not backoff.wait():
+                return None
+
+    @classmethod
+    def acquire_many(
+        cls, identifiers, wait=True, steal_after_ms=None, max_wait_ms=None, backoff=None, lease_ms=None,
+        stats=None
+    ):
+        """ Acquire the locks for all of the given `identifiers`, or none of them. Locks are taken
+            in order of their identifier hash to avoid deadlocking with other threads acquiring an
+            overlapping set of locks. Returns a list of locks in that order, or None.
+            `stats` is populated in the same way as for `acquire`.
+        """
+        identifiers = sorted(set(identifiers), key=lambda x: hashlib.md5(x.encode()).hexdigest())
+        unique_value = uuid.uuid4().hex
+
+        if backoff is None:
+            backoff = start_backoff(max_wait_ms=max_wait_ms)
+
+        if stats is None:
+            stats = {}
+        stats.update(attempts=0, stolen=False)
+
+        while True:
+            stats["attempts"] += 1
+
+            # Check whether any of the locks are held in a single round trip before trying
+            # to add them, unless we might be able to steal them anyway
+            if steal_after_ms is not None or not cache.get_many(identifiers):
+                locks = []
+                stolen = False
+                for identifier in identifiers:
+                    acquired = cache.add(identifier, (unique_value, time.time()), _lease_timeout(lease_ms))
+                    if not acquired and steal_after_ms is not None:
+                        acquired = cls._steal(identifier, unique_value, steal_after_ms, lease_ms)
+                        stolen = stolen or acquired
+
+                    if not acquired:
+                        # Give back what we have so far, so we don't block anyone else while we wait
+                        cls.release_many(locks)
+                        break
+
+                    locks.append(cls(identifier, cache, unique_value, lease_ms))
+                else:
+                    stats["stolen"] = stolen
+                    return locks
+
+            # Back off before trying again, unless we're not waiting or have waited long enough
+            if not wait or not backoff.wait():
                 return None
-            else:
-                # We are waiting for the lock
-                if (datetime.utcnow() - start_time).total_seconds() * 1000 > steal_after_ms:
-                    # Steal anyway
-                    cache.set(identifier, unique_value)
-                    return cls(identifier, cache, unique_value)
 
-                time.sleep(0)
+    @classmethod
+    def release_many(cls, locks):
+        """ Release all of the given locks, fetching and deleting them in a single round trip. """
+        if not locks:
+            return
+
+        current = cache.get_many([lock.identifier for lock in locks])
+        cache.delete_many([
+            lock.identifier for lock in locks
+            if isinstance(current.get(lock.identifier), tuple) and
+            current[lock.identifier][0] == lock.unique_value
+        ])
+
+    def renew(self, lease_ms):
+        """ Extend the lease on this lock by `lease_ms` from now. Returns False if the lock has
+            expired, or been stolen by another thread.
+        """
+        cache = self._cache
+
+        # As with release, there is a race condition here if the lock expires or is stolen
+        # between the get and the set
+        current = cache.get(self.identifier)
+        if not isinstance(current, tuple) or current[0] != self.unique_value:
+            return False
+
+        self.lease_ms = lease_ms
+        cache.set(self.identifier, (self.unique_value, time.time()), _lease_timeout(lease_ms))
+        return True
 
     def release(self):
         cache = self._cache
 
         # Delete the key if it was ours. There is a race condition here
         # if something steals the lock between the if and the delete...
-        if cache.get(self.identifier) == self.unique_value:
+        current = cache.get(self.identifier)
+        if isinstance(current, tuple) and current[0] == self.unique_value:
             cache.delete(self.identifier)
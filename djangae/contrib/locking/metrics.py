@@ -0,0 +1,145 @@
+# STANDARD LIB
+import threading
+import time
+
+# THIRD PARTY
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+
+# Sent with `identifier`, `kind`, `wait_ms`, `attempts` and `stolen` when a lock is acquired
+lock_acquired = Signal()
+# Sent with `identifier`, `kind`, `wait_ms` and `attempts` when a lock couldn't be acquired
+lock_acquisition_failed = Signal()
+# Sent with `identifier`, `kind` and `hold_ms` when a lock is released
+lock_released = Signal()
+
+
+# How often each process writes its stats to the cache
+STATS_FLUSH_INTERVAL_SECONDS = 60
+STATS_CACHE_KEY_PREFIX = "djangae-lock-stats"
+STATS_CACHE_TIMEOUT = 60 * 60 * 24
+
+_COUNTERS = (
+    "attempts", "acquisitions", "failures", "steals", "releases",
+    "total_wait_ms", "max_wait_ms", "total_hold_ms", "max_hold_ms",
+)
+
+
+def identifier_prefix(identifier):
+    """ Returns the prefix of the identifier that stats are grouped by. By default this is
+        everything before the first ':', but it can be overridden by setting
+        DJANGAE_LOCKING_METRICS_PREFIX_FUNCTION to the import path of a function.
+    """
+    function_path = getattr(settings, "DJANGAE_LOCKING_METRICS_PREFIX_FUNCTION", None)
+    if function_path:
+        return import_string(function_path)(identifier)
+
+    return identifier.split(":", 1)[0]
+
+
+def _cache_key(kind, prefix):
+    return "%s:%s:%s" % (STATS_CACHE_KEY_PREFIX, kind, prefix)
+
+
+_index_key = "%s:index" % STATS_CACHE_KEY_PREFIX
+
+
+class LockStats(object):
+    """ Aggregates lock stats in this process, and periodically adds them to the totals (across
+        all instances) in the cache. Cache updates aren't atomic so concurrent flushes from
+        different instances can occasionally lose counts.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._last_flush = time.time()
+
+    def _record(self, identifier, kind, **values):
+        key = (kind, identifier_prefix(identifier))
+        with self._lock:
+            stats = self._stats.setdefault(key, dict.fromkeys(_COUNTERS, 0))
+            for name, value in values.items():
+                if name.startswith("max_"):
+                    stats[name] = max(stats[name], value)
+                else:
+                    stats[name] += value
+
+            should_flush = time.time() - self._last_flush > STATS_FLUSH_INTERVAL_SECONDS
+
+        if should_flush:
+            self.flush()
+
+    def acquired(self, identifier, kind, wait_ms, attempts, stolen):
+        self._record(
+            identifier, kind, attempts=attempts, acquisitions=1, steals=int(stolen),
+            total_wait_ms=wait_ms, max_wait_ms=wait_ms
+        )
+        lock_acquired.send(
+            sender=LockStats, identifier=identifier, kind=kind, wait_ms=wait_ms, attempts=attempts, stolen=stolen
+        )
+
+    def failed(self, identifier, kind, wait_ms, attempts):
+        self._record(identifier, kind, attempts=attempts, failures=1, total_wait_ms=wait_ms, max_wait_ms=wait_ms)
+        lock_acquisition_failed.send(
+            sender=LockStats, identifier=identifier, kind=kind, wait_ms=wait_ms, attempts=attempts
+        )
+
+    def released(self, identifier, kind, hold_ms):
+        self._record(identifier, kind, releases=1, total_hold_ms=hold_ms, max_hold_ms=hold_ms)
+        lock_released.send(sender=LockStats, identifier=identifier, kind=kind, hold_ms=hold_ms)
+
+    def flush(self):
+        """ Add the stats from this process to the totals in the cache. """
+        with self._lock:
+            pending, self._stats = self._stats, {}
+            self._last_flush = time.time()
+
+        if not pending:
+            return
+
+        keys = [_cache_key(kind, prefix) for kind, prefix in pending]
+        totals = cache.get_many(keys + [_index_key])
+        index = set(totals.pop(_index_key, ()))
+
+        for (kind, prefix), key in zip(pending, keys):
+            total = totals.get(key) or dict.fromkeys(_COUNTERS, 0)
+            for name, value in pending[(kind, prefix)].items():
+                if name.startswith("max_"):
+                    total[name] = max(total.get(name, 0), value)
+                else:
+                    total[name] = total.get(name, 0) + value
+            totals[key] = total
+            index.add((kind, prefix))
+
+        totals[_index_key] = index
+        cache.set_many(totals, STATS_CACHE_TIMEOUT)
+
+    def hottest(self, limit=20):
+        """ Returns the stats for the `limit` lock prefixes with the most total wait time, across
+            all instances.
+        """
+        self.flush()
+
+        index = cache.get(_index_key) or set()
+        keys = {_cache_key(kind, prefix): (kind, prefix) for kind, prefix in index}
+        results = []
+        for key, stats in cache.get_many(list(keys)).items():
+            kind, prefix = keys[key]
+            results.append(dict(stats, kind=kind, prefix=prefix))
+
+        results.sort(key=lambda x: (x["total_wait_ms"], x["attempts"]), reverse=True)
+        return results[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._stats = {}
+
+        index = cache.get(_index_key) or set()
+        cache.delete_many([_cache_key(kind, prefix) for kind, prefix in index] + [_index_key])
+
+
+stats = LockStats()
@@ -1,8 +1,7 @@
 # STANDARD LIB
 from datetime import timedelta
 import hashlib
-import random
-import time
+import logging
 
 # THRID PARTY
 from django.db import models
@@ -13,10 +12,24 @@ from gcloudc.db import transaction
 from gcloudc.db.backends.datastore.transaction import TransactionFailedError
 from gcloudc.db.models.fields.charfields import CharField
 
+# DJANGAE
+from djangae.utils import retry
+
+from .backoff import start_backoff
+
+logger = logging.getLogger(__name__)
+
+
+def _identifier_hash(identifier):
+    return hashlib.md5(identifier.encode()).hexdigest()
+
 
 class LockQuerySet(models.query.QuerySet):
 
-    def acquire(self, identifier, wait=True, steal_after_ms=None, max_wait_ms=None):
+    def acquire(
+        self, identifier, wait=True, steal_after_ms=None, max_wait_ms=None, backoff=None, lease_ms=None,
+        stats=None
+    ):
         """ Create or fetch the Lock with the given `identifier`.
         `wait`:
             If True, wait until the Lock is available, otherwise if the lcok is not available then
@@ -28,45 +41,106 @@ class LockQuerySet(models.query.QuerySet):
         `max_wait_ms`:
             Wait, but only for this long. If no lock has been acquired then returns
             None.
+        `backoff`:
+            The (already started) `Backoff` to wait with between attempts, see `start_backoff`.
+            Defaults to the default backoff, limited to `max_wait_ms`.
+        `lease_ms`:
+            If passed, the lock expires this long after it was acquired (or last renewed with
+            `renew`), after which other threads can take it over.
+        `stats`:
+            If passed a dict, it's populated with the number of `attempts` made, and whether the
+            lock was `stolen`.
         """
-        identifier_hash = hashlib.md5(identifier.encode()).hexdigest()
+        locks = self.acquire_many(
+            [identifier], wait=wait, steal_after_ms=steal_after_ms, max_wait_ms=max_wait_ms, backoff=backoff,
+            lease_ms=lease_ms, stats=stats
+        )
+        return locks[0] if locks else None
 
-        start_time = timezone.now()
+    def acquire_many(
+        self, identifiers, wait=True, steal_after_ms=None, max_wait_ms=None, backoff=None, lease_ms=None,
+        stats=None
+    ):
+        """ Create or fetch the Locks for all of the given `identifiers` in a single transaction.
+            Either all of the locks are acquired, or none of them are. Returns a list of the locks,
+            ordered by their identifier hash, or None. Arguments are the same as for `acquire`.
+        """
+        hashes = {}
+        for identifier in identifiers:
+            hashes[_identifier_hash(identifier)] = identifier
+
+        if backoff is None:
+            backoff = start_backoff(max_wait_ms=max_wait_ms)
+
+        if stats is None:
+            stats = {}
+        stats.update(attempts=0, stolen=False)
 
         def trans():
             """ Wrapper for the atomic transaction that handles transaction errors """
             @transaction.atomic(independent=True)
             def _trans():
-                lock = self.filter(identifier_hash=identifier_hash).first()
-                if lock:
-                    # Lock already exists, so check if it's old enough to ignore/steal
-                    if (
-                        steal_after_ms and
-                        timezone.now() - lock.timestamp > timedelta(microseconds=steal_after_ms * 1000)
-                    ):
-                        # We can steal it.  Update timestamp to now and return it
-                        lock.timestamp = timezone.now()
-                        lock.save()
-                        return lock
+                stats["attempts"] += 1
+
+                if len(hashes) == 1:
+                    existing = list(self.filter(identifier_hash=list(hashes)[0])[:1])
                 else:
-                    return DatastoreLock.objects.create(
-                        identifier_hash=identifier_hash,
-                        identifier=identifier
-                    )
+                    existing = list(self.filter(identifier_hash__in=list(hashes)))
+
+                existing = {lock.pk: lock for lock in existing}
+
+                now = timezone.now()
+                expires = now + timedelta(microseconds=lease_ms * 1000) if lease_ms else None
+
+                for lock in existing.values():
+                    # Lock already exists, so check if its lease has expired, or if it's old
+                    # enough to ignore/steal
+                    if not lock.can_be_taken_over(steal_after_ms, now=now):
+                        return None
+
+                locks = []
+                for identifier_hash in sorted(hashes):
+                    lock = existing.get(identifier_hash)
+                    if lock:
+                        # We can steal it.  Update timestamp to now
+                        lock.timestamp = now
+                        lock.expires = expires
+                        lock.save()
+                    else:
+                        lock = DatastoreLock.objects.create(
+                            identifier_hash=identifier_hash,
+                            identifier=hashes[identifier_hash],
+                            timestamp=now,
+                            expires=expires,
+                        )
+                    locks.append(lock)
+
+                stats["stolen"] = bool(existing)
+                return locks
+
             try:
                 return _trans()
             except TransactionFailedError:
                 return None
 
-        lock = trans()
-        while wait and lock is None:
-            # If more than max_wait_ms has elapsed, then give up
-            if (max_wait_ms is not None) and (timezone.now() - start_time > timedelta(microseconds=max_wait_ms * 1000)):
+        locks = trans()
+        while wait and locks is None:
+            # Back off between retries, or give up if more than max_wait_ms has elapsed
+            if not backoff.wait():
                 break
 
-            time.sleep(random.uniform(0, 1))  # Sleep for a random bit between retries
-            lock = trans()
-        return lock
+            locks = trans()
+        return locks
+
+    def release_many(self, locks):
+        """ Release all of the given locks, deleting the ones without leases in a single batch. """
+        unleased = [lock.pk for lock in locks if lock.expires is None]
+        if unleased:
+            self.filter(identifier_hash__in=unleased).delete()
+
+        for lock in locks:
+            if lock.expires is not None:
+                lock.release()
 
 
 @python_2_unicode_compatible
@@ -80,9 +154,69 @@ class DatastoreLock(models.Model):
     identifier_hash = CharField(primary_key=True)
     identifier = CharField()
     timestamp = models.DateTimeField(default=timezone.now)
+    # When the lease on this lock runs out, if it was acquired with one
+    expires = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.identifier
 
+    def can_be_taken_over(self, steal_after_ms=None, now=None):
+        """ Returns True if this lock's lease has expired, or it's older than `steal_after_ms`. """
+        now = now or timezone.now()
+        return bool(
+            (self.expires and self.expires < now) or (
+                steal_after_ms and
+                now - self.timestamp > timedelta(microseconds=steal_after_ms * 1000)
+            )
+        )
+
+    def _is_ours(self, lock):
+        # The timestamp is updated whenever the lock changes hands, so if it still matches
+        # ours then nobody has taken over the lock since we acquired or renewed it
+        return lock is not None and lock.timestamp == self.timestamp
+
+    def renew(self, lease_ms):
+        """ Extend the lease on this lock by `lease_ms` from now. Returns False if the lock has
+            been released, or taken over by another thread since its lease expired.
+        """
+        @transaction.atomic(independent=True)
+        def trans():
+            lock = DatastoreLock.objects.filter(pk=self.pk).first()
+            if not self._is_ours(lock):
+                return False
+
+            lock.timestamp = timezone.now()
+            lock.expires = lock.timestamp + timedelta(microseconds=lease_ms * 1000)
+            lock.save()
+            return lock
+
+        try:
+            lock = trans()
+        except TransactionFailedError:
+            return False
+
+        if not lock:
+            return False
+
+        self.timestamp = lock.timestamp
+        self.expires = lock.expires
+        return True
+
     def release(self):
-        self.delete()
+        if self.expires is None:
+            self.delete()
+            return
+
+        # Leased locks can be taken over once they expire, so make sure we don't delete
+        # a lock which now belongs to someone else
+        @transaction.atomic(independent=True)
+        def trans():
+            lock = DatastoreLock.objects.filter(pk=self.pk).first()
+            if self._is_ours(lock):
+                lock.delete()
+
+        try:
+            retry(trans, _catch=(TransactionFailedError,))
+        except TransactionFailedError:
+            # The lock will be taken over once its lease expires, so there's no need to fail the caller
+            logger.warning("Unable to release lock '%s', it will be released when its lease expires", self.identifier)
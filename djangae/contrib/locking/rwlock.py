@@ -0,0 +1,211 @@
+# STANDARD LIB
+import time
+import uuid
+
+# THIRD PARTY
+from django.core.cache import cache
+
+# DJANGAE
+from .backoff import start_backoff
+from .kinds import LOCK_KINDS
+from .lock import (
+    Lock,
+    LocknessMonster,
+)
+from .memcache import _lease_timeout
+
+
+def _writer_identifier(identifier):
+    return "%s:writer" % identifier
+
+
+def _readers_identifier(identifier):
+    return "%s:readers:" % identifier
+
+
+def _reader_timeout(lease_ms):
+    # Readers without a lease are counted until they're released, like a STRONG reader
+    return None if lease_ms is None else _lease_timeout(lease_ms)
+
+
+def _extend_reader_count(key, lease_ms, created=False):
+    """ Makes sure that the reader count at `key` lasts for at least the lease of a reader which
+        has just joined (or renewed). The count is shared by all of the readers, so its expiry is
+        only ever extended, never shortened to a shorter lease. The latest expiry so far is kept
+        alongside the count, as the cache can't tell us when a key expires. Returns False if the
+        count has expired.
+    """
+    timeout = _reader_timeout(lease_ms)
+    expires = float("inf") if timeout is None else time.time() + timeout
+    expires_key = key + "expires"
+
+    if not created:
+        current = cache.get(expires_key)
+        if current is not None and current >= expires:
+            return key in cache
+
+    cache.set(expires_key, expires, timeout)
+    return cache.touch(key, timeout)
+
+
+class _CacheReader(object):
+    """ A reader of a WEAK ReadWriteLock, which is counted in a single cache key. """
+
+    def __init__(self, key):
+        self.key = key
+
+    def renew(self, lease_ms):
+        # incr and decr don't extend the expiry of the count, so keep it for at least our lease
+        return _extend_reader_count(self.key, lease_ms)
+
+    def release(self):
+        try:
+            count = cache.decr(self.key)
+        except ValueError:
+            # The count has expired from the cache
+            return
+
+        if count < 0:
+            # The count expired and was recreated while we held the lock, so undo our decrement
+            # rather than leave it negative (which would hide the next reader from writers)
+            cache.incr(self.key, -count)
+
+
+class ReadWriteLock(object):
+    """ A lock which can be held by many readers at once, or by a single writer.
+        Readers are cheap to add and remove: for STRONG locks each reader writes its own
+        DatastoreLock (so readers never contend with each other), and for WEAK locks readers
+        increment a counter in the cache.
+        A writer first takes an exclusive lock, which stops any new readers, and then waits for
+        the existing readers to drain.
+    """
+
+    @classmethod
+    def _writer_is_active(cls, identifier, kind):
+        if kind == LOCK_KINDS.STRONG:
+            from .models import DatastoreLock, _identifier_hash  # Avoid importing models before they're ready
+            writer = DatastoreLock.objects.filter(
+                identifier_hash=_identifier_hash(_writer_identifier(identifier))
+            ).first()
+            return bool(writer and not writer.can_be_taken_over())
+        else:
+            return cache.get(_writer_identifier(identifier)) is not None
+
+    @classmethod
+    def _has_readers(cls, identifier, kind):
+        if kind == LOCK_KINDS.STRONG:
+            from .models import DatastoreLock  # Avoid importing models before they're ready
+            readers = DatastoreLock.objects.filter(identifier__startswith=_readers_identifier(identifier))
+            return any(not reader.can_be_taken_over() for reader in readers)
+        else:
+            return (cache.get(_readers_identifier(identifier)) or 0) > 0
+
+    @classmethod
+    def _add_reader(cls, identifier, kind, lease_ms):
+        if kind == LOCK_KINDS.STRONG:
+            # Each reader has its own lock, so acquiring it never has to wait
+            return Lock.acquire(
+                "%s%s" % (_readers_identifier(identifier), uuid.uuid4().hex),
+                wait=False, kind=kind, lease_ms=lease_ms
+            )
+        else:
+            key = _readers_identifier(identifier)
+            created = cache.add(key, 0, _reader_timeout(lease_ms))
+            try:
+                cache.incr(key)
+            except ValueError:
+                # The key expired between the add and the incr
+                return None
+
+            # incr doesn't extend the expiry of the count, so extend it to cover our lease. Otherwise
+            # it could expire while the earliest readers are still reading
+            _extend_reader_count(key, lease_ms, created=created)
+            return Lock._wrap(_CacheReader(key), identifier, kind, lease_ms)
+
+    @classmethod
+    def acquire_read(
+        cls, identifier, wait=True, kind=LOCK_KINDS.STRONG, max_wait_ms=None, backoff=None, lease_ms=None
+    ):
+        """ Acquire a shared (read) lock. Returns a `Lock`, or None if a writer holds (or is waiting
+            for) the lock and `wait` is False or `max_wait_ms` has elapsed.
+        """
+        backoff = start_backoff(backoff, max_wait_ms)
+
+        while True:
+            if not cls._writer_is_active(identifier, kind):
+                reader = cls._add_reader(identifier, kind, lease_ms)
+
+                # A writer may have arrived between checking and adding ourselves, so check again.
+                # Writers only wait for the readers which were added before they took their lock
+                if reader and not cls._writer_is_active(identifier, kind):
+                    return reader
+                elif reader:
+                    reader.release()
+
+            if not wait or not backoff.wait():
+                return None
+
+    @classmethod
+    def acquire_write(
+        cls, identifier, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None,
+        backoff=None, lease_ms=None
+    ):
+        """ Acquire an exclusive (write) lock, waiting for any readers to finish. Returns a `Lock`,
+            or None if `wait` is False or `max_wait_ms` elapses before the lock is acquired.
+            `steal_after_ms` applies to other writers.
+        """
+        backoff = start_backoff(backoff, max_wait_ms)
+
+        writer = Lock.acquire(
+            _writer_identifier(identifier), wait=wait, steal_after_ms=steal_after_ms, kind=kind,
+            max_wait_ms=max_wait_ms, backoff=backoff, lease_ms=lease_ms
+        )
+        if writer is None:
+            return None
+
+        # Now that we hold the writer lock no new readers can join, so wait for the existing ones
+        # to leave (while renewing our lease, if we have one)
+        while cls._has_readers(identifier, kind):
+            if not wait or not backoff.wait():
+                writer.release()
+                return None
+
+            if lease_ms:
+                writer.renew()
+
+        return writer
+
+
+class ReadLocknessMonster(LocknessMonster):
+    """ Function decorator and context manager which holds a shared (read) lock while a function
+        or block of code runs. Arguments are the same as for `lock`, apart from `steal_after_ms`.
+    """
+
+    def __init__(self, identifier, *args, **kwargs):
+        super().__init__(identifier, *args, **kwargs)
+        if self.steal_after_ms is not None:
+            raise ValueError("steal_after_ms is not supported for read locks")
+
+    def _acquire(self):
+        return ReadWriteLock.acquire_read(
+            self.identifier, self.wait, self.kind,
+            backoff=self.backoff,
+            lease_ms=self.lease_ms,
+        )
+
+
+class WriteLocknessMonster(LocknessMonster):
+    """ Function decorator and context manager which holds an exclusive (write) lock while a function
+        or block of code runs. Arguments are the same as for `lock`.
+    """
+
+    def _acquire(self):
+        return ReadWriteLock.acquire_write(
+            self.identifier, self.wait, self.steal_after_ms, self.kind,
+            backoff=self.backoff,
+            lease_ms=self.lease_ms,
+        )
+
+
+read_lock = ReadLocknessMonster
+write_lock = WriteLocknessMonster
@@ -0,0 +1,103 @@
+# STANDARD LIB
+import random
+import time
+
+# THIRD PARTY
+from django.core.cache import cache
+
+# DJANGAE
+from .backoff import start_backoff
+from .kinds import LOCK_KINDS
+from .lock import (
+    Lock,
+    LocknessMonster,
+)
+
+
+def _slot_identifiers(identifier, limit):
+    return ["%s:slot:%s" % (identifier, i) for i in range(limit)]
+
+
+class Semaphore(object):
+    """ A counting semaphore, which allows up to `limit` threads to hold it at once. Each slot is
+        an ordinary lock of the given kind (a DatastoreLock for STRONG, a cache key for WEAK).
+        Waiting threads read all of the slots at once, and then try the free ones in a random
+        order, so that they don't all contend for the same slot.
+    """
+
+    @classmethod
+    def _free_slots(cls, slots, kind, steal_after_ms):
+        if kind == LOCK_KINDS.STRONG:
+            from .models import DatastoreLock, _identifier_hash  # Avoid importing models before they're ready
+
+            hashes = {_identifier_hash(slot): slot for slot in slots}
+            held = set(
+                hashes[lock.pk] for lock in DatastoreLock.objects.filter(identifier_hash__in=list(hashes))
+                if not lock.can_be_taken_over(steal_after_ms)
+            )
+        elif kind == LOCK_KINDS.WEAK:
+            held = set()
+            now = time.time()
+            for slot, value in cache.get_many(slots).items():
+                try:
+                    timestamp = value[1]
+                except (TypeError, IndexError):
+                    timestamp = now
+
+                if steal_after_ms is None or (now - timestamp) * 1000 <= steal_after_ms:
+                    held.add(slot)
+        else:
+            raise Exception("Unsupported kind")
+
+        return [slot for slot in slots if slot not in held]
+
+    @classmethod
+    def acquire(
+        cls, identifier, limit, wait=True, steal_after_ms=None, kind=LOCK_KINDS.STRONG, max_wait_ms=None,
+        backoff=None, lease_ms=None
+    ):
+        """ Acquire one of the `limit` slots of the semaphore. Returns a `Lock` for the slot, or
+            None if `wait` is False (or `max_wait_ms` has passed) and all of the slots are taken.
+            The other arguments are the same as for `Lock.acquire`.
+        """
+        if limit < 1:
+            raise ValueError("limit must be > 0")
+
+        slots = _slot_identifiers(identifier, limit)
+
+        backoff = start_backoff(backoff, max_wait_ms)
+
+        while True:
+            free = cls._free_slots(slots, kind, steal_after_ms)
+            random.shuffle(free)
+
+            for slot in free:
+                slot_lock = Lock.acquire(
+                    slot, wait=False, steal_after_ms=steal_after_ms, kind=kind, lease_ms=lease_ms
+                )
+                if slot_lock:
+                    return slot_lock
+
+            # Back off before trying again, unless we're not waiting or have waited long enough
+            if not wait or not backoff.wait():
+                return None
+
+
+class SemaphoreMonster(LocknessMonster):
+    """ Function decorator and context manager which allows up to `limit` threads to run a
+        function or block of code at the same time. Other arguments are the same as for `lock`.
+    """
+
+    def __init__(self, identifier, limit, *args, **kwargs):
+        super().__init__(identifier, *args, **kwargs)
+        self.limit = limit
+
+    def _acquire(self):
+        return Semaphore.acquire(
+            self.identifier, self.limit, self.wait, self.steal_after_ms, self.kind,
+            backoff=self.backoff,
+            lease_ms=self.lease_ms,
+        )
+
+
+semaphore = SemaphoreMonster
@@ -0,0 +1,82 @@
+# STANDARD LIB
+import time
+
+# THIRD PARTY
+from django.core.cache import cache
+
+# DJANGAE
+from .backoff import start_backoff
+from .kinds import LOCK_KINDS
+from .lock import Lock
+
+# How long callers without a stale value wait for another thread to compute the value, before
+# giving up and computing it themselves
+DEFAULT_MAX_WAIT_MS = 5000
+
+# How long the thread computing the value holds the lock for, in case it dies before releasing it
+DEFAULT_LEASE_MS = 30000
+
+
+def _now():  # Patchable
+    return time.time()
+
+
+def _cache_key(key):
+    return "djangae-singleflight:%s" % key
+
+
+def _lock_identifier(key):
+    return "singleflight:%s" % key
+
+
+def _is_fresh(entry):
+    return entry is not None and entry[1] > _now()
+
+
+def _compute(key, compute, ttl, stale_ttl):
+    value = compute()
+    # A timeout of 0 would expire the value immediately, so always keep it for at least a second
+    cache.set(_cache_key(key), (value, _now() + ttl), max(1, ttl + stale_ttl))
+    return value
+
+
+def singleflight(key, compute, ttl, stale_ttl=None, max_wait_ms=DEFAULT_MAX_WAIT_MS, lease_ms=DEFAULT_LEASE_MS):
+    """ Returns the value cached under `key`, calling `compute` to (re)calculate it if it's missing
+        or older than `ttl` seconds. Only one thread at a time computes the value for a given key
+        (using a WEAK lock), so an expensive value expiring doesn't cause a stampede.
+        While the value is being recomputed, other callers get the stale value if it's less than
+        `ttl + stale_ttl` seconds old (`stale_ttl` defaults to `ttl`), otherwise they wait for up to
+        `max_wait_ms` for the shared result before computing it themselves.
+    """
+    stale_ttl = ttl if stale_ttl is None else stale_ttl
+
+    entry = cache.get(_cache_key(key))
+    if _is_fresh(entry):
+        return entry[0]
+
+    backoff = start_backoff(max_wait_ms=max_wait_ms)
+
+    while True:
+        lock = Lock.acquire(_lock_identifier(key), wait=False, kind=LOCK_KINDS.WEAK, lease_ms=lease_ms)
+        if lock:
+            try:
+                # Another thread may have finished computing the value since we last checked
+                entry = cache.get(_cache_key(key))
+                if _is_fresh(entry):
+                    return entry[0]
+
+                return _compute(key, compute, ttl, stale_ttl)
+            finally:
+                lock.release()
+
+        if entry is not None:
+            # Someone else is already recomputing the value, so don't wait for them
+            return entry[0]
+
+        if not backoff.wait():
+            # Whoever is computing the value is taking too long, so compute it ourselves
+            return _compute(key, compute, ttl, stale_ttl)
+
+        entry = cache.get(_cache_key(key))
+        if _is_fresh(entry):
+            return entry[0]
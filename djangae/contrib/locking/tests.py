@@ -1,7 +1,11 @@
 # STANDARD LIB
+import asyncio
 import hashlib
+import threading
+import time
 
 # THIRD PARTY
+from django.core.cache import cache
 from django.utils import timezone
 
 # DJANGAE
@@ -9,15 +13,42 @@ from djangae.contrib import sleuth
 from djangae.test import TestCase
 from gcloudc.db.backends.datastore import transaction
 
+from .aio import (
+    acquire_async,
+    alock,
+    release_async,
+)
+from .backoff import (
+    Backoff,
+    start_backoff,
+)
 from .kinds import LOCK_KINDS
 from .lock import (
     Lock,
     LockAcquisitionError,
     lock,
+    lock_many,
 )
 from .memcache import MemcacheLock
+from .metrics import (
+    lock_acquired,
+    stats,
+)
 from .models import DatastoreLock
-from .views import cleanup_locks
+from .rwlock import (
+    ReadWriteLock,
+    read_lock,
+    write_lock,
+)
+from .semaphore import (
+    Semaphore,
+    semaphore,
+)
+from .singleflight import singleflight
+from .views import (
+    cleanup_locks,
+    cleanup_locks_task,
+)
 
 
 class DatastoreLocksTestCase(TestCase):
@@ -101,6 +132,89 @@ class DatastoreLocksTestCase(TestCase):
         # The old lock should have been deleted but the new one should not
         self.assertCountEqual(DatastoreLock.objects.all(), [recent_lock])
 
+    def test_cleanup_continues_in_batches(self):
+        ages_ago = timezone.now() - timezone.timedelta(minutes=15)
+        for i in range(7):
+            self._make_lock("old_lock_%s" % i, timestamp=ages_ago)
+        recent_lock = self._make_lock("recent_lock")
+
+        # With no time budget, each batch should be deleted by a new task
+        with sleuth.switch("djangae.contrib.locking.views.CLEANUP_BATCH_SIZE", 2):
+            with sleuth.switch("djangae.contrib.locking.views.CLEANUP_TIME_BUDGET_SECONDS", 0):
+                with sleuth.watch("djangae.tasks.deferred.defer") as defer_watch:
+                    cleanup_locks_task()
+                    self.process_task_queues()
+
+        self.assertTrue(defer_watch.called)
+        self.assertCountEqual(DatastoreLock.objects.all(), [recent_lock])
+
+    def test_cleanup_sharded_for_large_backlog(self):
+        for i in range(20):
+            self._make_lock(
+                "old_lock_%s" % i, timestamp=timezone.now() - timezone.timedelta(minutes=15 + i)
+            )
+        recent_lock = self._make_lock("recent_lock")
+
+        with sleuth.switch("djangae.contrib.locking.views.CLEANUP_SHARD_THRESHOLD", 5):
+            with sleuth.watch("djangae.tasks.deferred.defer") as defer_watch:
+                cleanup_locks_task()
+                self.process_task_queues()
+
+        self.assertTrue(any(call.kwargs.get("sharded") for call in defer_watch.calls))
+        self.assertCountEqual(DatastoreLock.objects.all(), [recent_lock])
+
+    def test_cleanup_totals_sharded_deletes(self):
+        for i in range(20):
+            self._make_lock(
+                "old_lock_%s" % i, timestamp=timezone.now() - timezone.timedelta(minutes=15 + i)
+            )
+
+        with sleuth.switch("djangae.contrib.locking.views.CLEANUP_SHARD_THRESHOLD", 5):
+            with sleuth.watch("djangae.contrib.locking.views._shard_finished") as shard_finished:
+                cleanup_locks_task()
+                self.process_task_queues()
+
+        self.assertTrue(shard_finished.called)
+        # Only the last shard to finish returns the total
+        totals = [total for total in shard_finished.call_returns if total is not None]
+        self.assertEqual([20], totals)
+
+    def test_cleanup_skips_unexpired_leases(self):
+        ages_ago = timezone.now() - timezone.timedelta(minutes=15)
+        leased_lock = self._make_lock(
+            "leased_lock", timestamp=ages_ago, expires=timezone.now() + timezone.timedelta(minutes=5)
+        )
+        self._make_lock("expired_lock", timestamp=ages_ago, expires=ages_ago)
+        for i in range(3):
+            self._make_lock("old_lock_%s" % i, timestamp=ages_ago)
+
+        # The leased lock is skipped rather than deleted, so the cleanup still finishes
+        with sleuth.switch("djangae.contrib.locking.views.CLEANUP_BATCH_SIZE", 1):
+            cleanup_locks_task()
+
+        self.assertCountEqual(DatastoreLock.objects.all(), [leased_lock])
+
+    def test_cleanup_continues_past_unexpired_leases(self):
+        ages_ago = timezone.now() - timezone.timedelta(minutes=15)
+        leased_locks = [
+            self._make_lock(
+                "leased_lock_%s" % i, timestamp=ages_ago, expires=timezone.now() + timezone.timedelta(minutes=5)
+            )
+            for i in range(3)
+        ]
+        for i in range(4):
+            self._make_lock("old_lock_%s" % i, timestamp=ages_ago)
+
+        # Each task continues after the leased locks skipped by the previous ones
+        with sleuth.switch("djangae.contrib.locking.views.CLEANUP_BATCH_SIZE", 2):
+            with sleuth.switch("djangae.contrib.locking.views.CLEANUP_TIME_BUDGET_SECONDS", 0):
+                with sleuth.watch("djangae.tasks.deferred.defer") as defer_watch:
+                    cleanup_locks_task()
+                    self.process_task_queues()
+
+        self.assertTrue(all(call.kwargs.get("resume_from") for call in defer_watch.calls))
+        self.assertCountEqual(DatastoreLock.objects.all(), leased_locks)
+
     def test_transaction_errors_are_handled(self):
         with sleuth.detonate(
             'djangae.contrib.locking.models.LockQuerySet.filter', transaction.TransactionFailedError
@@ -117,6 +231,81 @@ class DatastoreLocksTestCase(TestCase):
         # If we stole it, this wouldn't be None
         self.assertIsNone(lock2)
 
+    def test_backoff_capped_by_max_wait(self):
+        Lock.acquire("my_lock")
+
+        with sleuth.watch("djangae.contrib.locking.backoff._sleep") as sleep_watch:
+            lock = Lock.acquire("my_lock", max_wait_ms=50, backoff=Backoff(initial_ms=10, max_ms=1000))
+
+        self.assertIsNone(lock)
+        self.assertTrue(sleep_watch.called)
+        # We should never sleep for longer than the time left before max_wait_ms
+        self.assertTrue(all(call.args[0] <= 0.05 for call in sleep_watch.calls))
+
+    def test_expired_lease_taken_over(self):
+        lock1 = Lock.acquire("my_lock", lease_ms=10)
+        self.assertIsNone(Lock.acquire("my_lock", wait=False))
+
+        time.sleep(0.02)
+        lock2 = Lock.acquire("my_lock", wait=False, lease_ms=10000)
+        self.assertTrue(lock2)
+
+        # The original holder has lost the lock, so can't renew it or release it
+        self.assertFalse(lock1.renew())
+        lock1.release()
+        self.assertIsNone(Lock.acquire("my_lock", wait=False))
+
+        self.assertTrue(lock2.renew())
+        lock2.release()
+        self.assertTrue(Lock.acquire("my_lock", wait=False))
+
+    def test_leased_release_retries_transaction_errors(self):
+        my_lock = Lock.acquire("my_lock", lease_ms=10000)
+
+        failures = [transaction.TransactionFailedError()]
+        delete = DatastoreLock.delete
+
+        def flaky_delete(lock, *args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return delete(lock, *args, **kwargs)
+
+        with sleuth.switch("djangae.utils._yield", lambda seconds: None):
+            with sleuth.switch("djangae.contrib.locking.models.DatastoreLock.delete", flaky_delete):
+                my_lock.release()
+
+        self.assertTrue(Lock.acquire("my_lock", wait=False))
+
+    def test_heartbeat_renews_lease(self):
+        with lock("my_lock", lease_ms=100, heartbeat=True):
+            time.sleep(0.3)
+            self.assertIsNone(Lock.acquire("my_lock", wait=False))
+
+        self.assertTrue(Lock.acquire("my_lock", wait=False))
+
+
+class BackoffTestCase(TestCase):
+    """ Tests for the backoff used between lock acquisition attempts. """
+
+    def test_waits_within_bounds(self):
+        backoff = Backoff(initial_ms=10, max_ms=100)
+        previous = 10
+        for i in range(20):
+            delay = backoff.next_ms()
+            self.assertTrue(10 <= delay <= min(100, previous * 3))
+            previous = delay
+
+    def test_fast_first_retry(self):
+        backoff = Backoff(initial_ms=10, max_ms=100, fast_first_retry=True)
+        self.assertEqual(0, backoff.next_ms())
+        self.assertTrue(backoff.next_ms() >= 10)
+
+    def test_max_wait_ms(self):
+        backoff = Backoff(initial_ms=10, max_ms=100, max_wait_ms=0)
+        with sleuth.watch("djangae.contrib.locking.backoff._sleep") as sleep_watch:
+            self.assertFalse(backoff.wait())
+        self.assertFalse(sleep_watch.called)
+
 
 class MemcacheLocksTestCase(TestCase):
     """ Tests for the implementation of the WEAK kind of lock (MemcacheLock). """
@@ -177,3 +366,419 @@ class MemcacheLocksTestCase(TestCase):
         # And with the lock released the function should run
         my_lock.release()
         self.assertTrue(do_something())
+
+    def test_max_wait_ms(self):
+        lock1 = Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK)
+        self.assertTrue(lock1)
+
+        # Wait 100 ms
+        lock2 = Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, max_wait_ms=100, steal_after_ms=10000)
+        self.assertIsNone(lock2)
+
+    def test_no_steal_without_steal_after_ms(self):
+        MemcacheLock.acquire("x")
+        self.assertIsNone(MemcacheLock.acquire("x", max_wait_ms=50))
+
+    def test_backoff_between_attempts(self):
+        MemcacheLock.acquire("x")
+        with sleuth.watch("djangae.contrib.locking.backoff._sleep") as sleep_watch:
+            MemcacheLock.acquire("x", backoff=start_backoff(Backoff(initial_ms=10), max_wait_ms=50))
+
+        # We shouldn't busy-spin while waiting
+        self.assertTrue(sleep_watch.called)
+        self.assertTrue(all(call.args[0] > 0 for call in sleep_watch.calls))
+
+    def test_stale_lock_only_stolen_once(self):
+        old_lock = MemcacheLock.acquire("x")
+        # Make the existing lock look ancient
+        cache.set("x", (old_lock.unique_value, 0))
+
+        stolen = MemcacheLock.acquire("x", wait=False, steal_after_ms=10)
+        self.assertTrue(stolen)
+        # Nobody else can steal the same stale lock
+        self.assertEqual(cache.get("x")[0], stolen.unique_value)
+
+        # The lock now belongs to the thief, so the old holder releasing it shouldn't affect it
+        old_lock.release()
+        self.assertIsNone(MemcacheLock.acquire("x", wait=False))
+        stolen.release()
+        self.assertTrue(MemcacheLock.acquire("x", wait=False))
+
+    def test_expired_lease_taken_over(self):
+        lock1 = Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, lease_ms=1000)
+        self.assertIsNone(Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, wait=False))
+
+        time.sleep(1.1)
+        lock2 = Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, wait=False, lease_ms=10000)
+        self.assertTrue(lock2)
+        self.assertFalse(lock1.renew())
+        self.assertTrue(lock2.renew())
+
+    def test_heartbeat_renews_lease(self):
+        with lock("my_lock", kind=LOCK_KINDS.WEAK, lease_ms=1000, heartbeat=True):
+            time.sleep(1.5)
+            self.assertIsNone(Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, wait=False))
+
+        self.assertTrue(Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, wait=False))
+
+    def test_lease_rounded_up_to_seconds(self):
+        with sleuth.watch("django.core.cache.cache.add") as cache_add:
+            Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK, lease_ms=10)
+            Lock.acquire("other_lock", kind=LOCK_KINDS.WEAK, lease_ms=1500)
+
+        # A timeout of 0 would never expire on memcached
+        self.assertEqual([1, 2], [call.args[2] for call in cache_add.calls])
+
+    def test_renew_requires_lease(self):
+        my_lock = Lock.acquire("my_lock", kind=LOCK_KINDS.WEAK)
+        self.assertRaises(ValueError, my_lock.renew)
+        self.assertRaises(ValueError, my_lock.start_heartbeat)
+
+
+class AcquireManyTestCase(TestCase):
+    """ Tests for acquiring several locks at once, for both kinds of lock. """
+
+    def test_acquire_many_all_or_nothing(self):
+        for kind in (LOCK_KINDS.STRONG, LOCK_KINDS.WEAK):
+            held = Lock.acquire("b", kind=kind)
+
+            # One of the locks is held, so we shouldn't get any of them
+            self.assertIsNone(Lock.acquire_many(["a", "b", "c"], kind=kind, wait=False))
+            # ...and any locks which were taken before failing should have been given back
+            free_lock = Lock.acquire("a", kind=kind, wait=False)
+            self.assertTrue(free_lock)
+            free_lock.release()
+
+            held.release()
+            locks = Lock.acquire_many(["a", "b", "c"], kind=kind, wait=False)
+            self.assertTrue(locks)
+            for identifier in ("a", "b", "c"):
+                self.assertIsNone(Lock.acquire(identifier, kind=kind, wait=False))
+
+            locks.release()
+            for identifier in ("a", "b", "c"):
+                self.assertTrue(Lock.acquire(identifier, kind=kind, wait=False))
+
+    def test_strong_acquire_many_single_transaction(self):
+        with sleuth.watch("djangae.contrib.locking.models.transaction.atomic") as atomic_watch:
+            locks = Lock.acquire_many(["a", "b", "c"])
+
+        self.assertTrue(locks)
+        self.assertEqual(1, atomic_watch.call_count)
+        self.assertEqual(3, DatastoreLock.objects.count())
+
+        locks.release()
+        self.assertEqual(0, DatastoreLock.objects.count())
+
+    def test_lock_many_context_manager(self):
+        def do_context():
+            with lock_many(["a", "b"], wait=False):
+                return True
+
+        my_lock = Lock.acquire("a")
+        self.assertRaises(LockAcquisitionError, do_context)
+        my_lock.release()
+        self.assertTrue(do_context())
+
+
+class SemaphoreTestCase(TestCase):
+    """ Tests for the counting semaphore, for both kinds of lock. """
+
+    def test_limit(self):
+        for kind in (LOCK_KINDS.STRONG, LOCK_KINDS.WEAK):
+            slots = [Semaphore.acquire("my_semaphore", 3, kind=kind, wait=False) for i in range(3)]
+            self.assertTrue(all(slots))
+
+            # All of the slots are taken
+            self.assertIsNone(Semaphore.acquire("my_semaphore", 3, kind=kind, wait=False))
+
+            slots[0].release()
+            self.assertTrue(Semaphore.acquire("my_semaphore", 3, kind=kind, wait=False))
+
+    def test_max_wait_ms(self):
+        Semaphore.acquire("my_semaphore", 1)
+        self.assertIsNone(Semaphore.acquire("my_semaphore", 1, max_wait_ms=50))
+
+    def test_context_manager(self):
+        def do_context():
+            with semaphore("my_semaphore", limit=2, wait=False, kind=LOCK_KINDS.WEAK):
+                return True
+
+        Semaphore.acquire("my_semaphore", 2, kind=LOCK_KINDS.WEAK)
+        self.assertTrue(do_context())
+
+        Semaphore.acquire("my_semaphore", 2, kind=LOCK_KINDS.WEAK)
+        self.assertRaises(LockAcquisitionError, do_context)
+
+
+class ReadWriteLockTestCase(TestCase):
+    """ Tests for the reader-writer lock, for both kinds of lock. """
+
+    def test_many_readers(self):
+        for kind in (LOCK_KINDS.STRONG, LOCK_KINDS.WEAK):
+            readers = [ReadWriteLock.acquire_read("config", kind=kind, wait=False) for i in range(5)]
+            self.assertTrue(all(readers))
+
+            # A writer has to wait for the readers
+            self.assertIsNone(ReadWriteLock.acquire_write("config", kind=kind, wait=False))
+
+            for reader in readers:
+                reader.release()
+
+            writer = ReadWriteLock.acquire_write("config", kind=kind, wait=False)
+            self.assertTrue(writer)
+
+            # Readers and other writers have to wait for the writer
+            self.assertIsNone(ReadWriteLock.acquire_read("config", kind=kind, wait=False))
+            self.assertIsNone(ReadWriteLock.acquire_write("config", kind=kind, wait=False))
+
+            writer.release()
+            self.assertTrue(ReadWriteLock.acquire_read("config", kind=kind, wait=False))
+
+    def test_weak_reader_count_never_negative(self):
+        reader1 = ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False)
+
+        # The count expires while the first reader still holds the lock, so it's recreated by the next
+        cache.delete("config:readers:")
+        reader2 = ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False)
+        reader1.release()
+        reader2.release()
+        self.assertEqual(0, cache.get("config:readers:"))
+
+        # The next reader must still hold off writers
+        ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False)
+        self.assertIsNone(ReadWriteLock.acquire_write("config", kind=LOCK_KINDS.WEAK, wait=False))
+
+    def test_weak_reader_count_kept_for_lease(self):
+        with sleuth.watch("django.core.cache.cache.touch") as touch:
+            reader = ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False, lease_ms=5000)
+            reader.renew()
+
+        self.assertEqual([5, 5], [call.args[1] for call in touch.calls])
+
+    def test_weak_reader_count_never_shortened(self):
+        with sleuth.watch("django.core.cache.cache.touch") as touch:
+            long_reader = ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False, lease_ms=60000)
+            short_reader = ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False, lease_ms=5000)
+            self.assertTrue(short_reader.renew())
+
+        # The shorter lease mustn't cut the count's expiry short while the first reader is reading
+        self.assertEqual([60], [call.args[1] for call in touch.calls])
+        long_reader.release()
+        short_reader.release()
+
+        # Readers without a lease keep the count until they're released
+        with sleuth.watch("django.core.cache.cache.touch") as touch:
+            ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False, lease_ms=5000)
+            ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False)
+            ReadWriteLock.acquire_read("config", kind=LOCK_KINDS.WEAK, wait=False, lease_ms=60000)
+
+        self.assertEqual([5, None], [call.args[1] for call in touch.calls])
+
+    def test_writer_max_wait_ms(self):
+        ReadWriteLock.acquire_read("config")
+        self.assertIsNone(ReadWriteLock.acquire_write("config", max_wait_ms=50))
+
+        # The writer should have given up its lock, so readers can still get in
+        self.assertTrue(ReadWriteLock.acquire_read("config", wait=False))
+
+    def test_context_managers(self):
+        def do_write():
+            with write_lock("config", wait=False):
+                return True
+
+        with read_lock("config"):
+            with read_lock("config"):
+                self.assertRaises(LockAcquisitionError, do_write)
+
+        self.assertTrue(do_write())
+
+
+class LocalLockTestCase(TestCase):
+    """ Tests for the in-process tier in front of both kinds of lock. """
+
+    def _acquire_in_thread(self, *args, **kwargs):
+        result = []
+        thread = threading.Thread(target=lambda: result.append(Lock.acquire(*args, **kwargs)))
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_threads_queue_locally(self):
+        for kind in (LOCK_KINDS.STRONG, LOCK_KINDS.WEAK):
+            my_lock = Lock.acquire("my_lock", kind=kind, local=True)
+
+            with sleuth.watch("djangae.contrib.locking.lock.Lock._acquire_remote") as remote_watch:
+                self.assertIsNone(self._acquire_in_thread("my_lock", kind=kind, local=True, wait=False))
+                self.assertIsNone(self._acquire_in_thread("my_lock", kind=kind, local=True, max_wait_ms=50))
+
+            # Other threads in this process shouldn't have competed for the lock remotely
+            self.assertFalse(remote_watch.called)
+
+            my_lock.release()
+            other_lock = self._acquire_in_thread("my_lock", kind=kind, local=True, wait=False)
+            self.assertTrue(other_lock)
+            other_lock.release()
+
+    def test_local_lock_skipped_after_steal_after_ms(self):
+        my_lock = Lock.acquire("my_lock", local=True)
+        DatastoreLock.objects.update(timestamp=timezone.now() - timezone.timedelta(seconds=10))
+
+        stolen = self._acquire_in_thread("my_lock", local=True, steal_after_ms=50)
+        self.assertTrue(stolen)
+
+        my_lock.release()
+        stolen.release()
+
+
+class AsyncLockTestCase(TestCase):
+    """ Tests for acquiring locks from async code. """
+
+    def test_alock(self):
+        for kind in (LOCK_KINDS.STRONG, LOCK_KINDS.WEAK):
+            async def run():
+                async with alock("my_lock", kind=kind):
+                    # Acquisition attempts run on the executor, so the event loop isn't blocked
+                    self.assertIsNone(await acquire_async("my_lock", kind=kind, wait=False))
+
+                held = await acquire_async("my_lock", kind=kind, wait=False)
+                self.assertTrue(held)
+
+                with self.assertRaises(LockAcquisitionError):
+                    async with alock("my_lock", kind=kind, max_wait_ms=50):
+                        pass
+
+                await release_async(held)
+
+            asyncio.run(run())
+
+    def test_backoff_uses_asyncio_sleep(self):
+        held = Lock.acquire("my_lock")
+
+        async def run():
+            return await acquire_async("my_lock", max_wait_ms=50)
+
+        with sleuth.watch("djangae.contrib.locking.backoff._sleep") as sleep_watch:
+            with sleuth.watch("asyncio.sleep") as async_sleep_watch:
+                self.assertIsNone(asyncio.run(run()))
+
+        self.assertFalse(sleep_watch.called)
+        self.assertTrue(async_sleep_watch.called)
+        held.release()
+
+
+class SingleflightTestCase(TestCase):
+    """ Tests for cache stampede protection. """
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+
+    def compute(self):
+        self.calls.append(True)
+        return len(self.calls)
+
+    def test_value_cached(self):
+        self.assertEqual(singleflight("total", self.compute, ttl=60), 1)
+        self.assertEqual(singleflight("total", self.compute, ttl=60), 1)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_stale_value_served_while_recomputing(self):
+        singleflight("total", self.compute, ttl=60, stale_ttl=60)
+
+        # The value is now stale, but still in the cache
+        later = time.time() + 90
+        with sleuth.switch("djangae.contrib.locking.singleflight._now", lambda: later):
+            # Another thread is recomputing the value
+            computing = Lock.acquire("singleflight:total", kind=LOCK_KINDS.WEAK)
+            self.assertEqual(singleflight("total", self.compute, ttl=60, stale_ttl=60, max_wait_ms=0), 1)
+            self.assertEqual(len(self.calls), 1)
+            computing.release()
+
+            self.assertEqual(singleflight("total", self.compute, ttl=60, stale_ttl=60), 2)
+
+    def test_zero_ttl_value_kept_for_stale_reads(self):
+        singleflight("total", self.compute, ttl=0, stale_ttl=0)
+
+        # A zero timeout would have expired the value immediately
+        self.assertIsNotNone(cache.get("djangae-singleflight:total"))
+
+    def test_waits_for_shared_result(self):
+        computing = Lock.acquire("singleflight:total", kind=LOCK_KINDS.WEAK)
+
+        def finish(*args, **kwargs):
+            cache.set("djangae-singleflight:total", ("shared", time.time() + 60))
+
+        # The other thread finishes computing while we're waiting
+        with sleuth.switch("djangae.contrib.locking.backoff._sleep", finish):
+            self.assertEqual(singleflight("total", self.compute, ttl=60), "shared")
+
+        self.assertFalse(self.calls)
+        computing.release()
+
+    def test_computes_after_max_wait(self):
+        computing = Lock.acquire("singleflight:total", kind=LOCK_KINDS.WEAK)
+        self.assertEqual(singleflight("total", self.compute, ttl=60, max_wait_ms=20), 1)
+        computing.release()
+
+
+class LockMetricsTestCase(TestCase):
+    """ Tests for the lock instrumentation. """
+
+    def setUp(self):
+        super().setUp()
+        stats.clear()
+
+    def test_stats_recorded(self):
+        with lock("account:1"):
+            pass
+
+        held = Lock.acquire("account:2")
+        self.assertIsNone(Lock.acquire("account:2", wait=False))
+        held.release()
+
+        Lock.acquire("other", kind=LOCK_KINDS.WEAK).release()
+
+        hottest = {(x["kind"], x["prefix"]): x for x in stats.hottest()}
+        account = hottest[(LOCK_KINDS.STRONG, "account")]
+        self.assertEqual(2, account["acquisitions"])
+        self.assertEqual(1, account["failures"])
+        self.assertEqual(2, account["releases"])
+        self.assertEqual(3, account["attempts"])
+        self.assertEqual(1, hottest[(LOCK_KINDS.WEAK, "other")]["acquisitions"])
+
+    def test_acquire_many_stats_recorded(self):
+        for kind in (LOCK_KINDS.STRONG, LOCK_KINDS.WEAK):
+            with lock_many(["account:1", "account:2", "other:1"], kind=kind):
+                self.assertIsNone(Lock.acquire_many(["account:1", "account:3"], kind=kind, wait=False))
+
+            hottest = {(x["kind"], x["prefix"]): x for x in stats.hottest()}
+            account = hottest[(kind, "account")]
+            # Each identifier is recorded, grouped by its prefix
+            self.assertEqual(2, account["acquisitions"])
+            self.assertEqual(2, account["failures"])
+            self.assertEqual(2, account["releases"])
+            self.assertEqual(1, hottest[(kind, "other")]["releases"])
+
+    def test_steals_recorded(self):
+        MemcacheLock.acquire("x")
+        cache.set("x", ("someone_else", 0))
+        Lock.acquire("x", kind=LOCK_KINDS.WEAK, steal_after_ms=10)
+
+        self.assertEqual(1, stats.hottest()[0]["steals"])
+
+    def test_signal_sent(self):
+        received = []
+
+        def handler(sender, **kwargs):
+            received.append(kwargs)
+
+        lock_acquired.connect(handler)
+        try:
+            Lock.acquire("my_lock")
+        finally:
+            lock_acquired.disconnect(handler)
+
+        self.assertEqual(1, len(received))
+        self.assertEqual("my_lock", received[0]["identifier"])
+        self.assertEqual(1, received[0]["attempts"])
@@ -1,13 +1,20 @@
 # STANDARD LIB
 import logging
+import time
 
 # THIRD PARTY
 from django.conf import settings
+from django.core.cache import cache
 from django.http import HttpResponse
 from django.utils import timezone
 
 
 # DJANGAE
+from djangae.processing import (
+    bulk_delete,
+    find_ranges_for_field,
+)
+
 from .models import DatastoreLock
 
 logger = logging.getLogger(__name__)
@@ -19,6 +26,17 @@ logger = logging.getLogger(__name__)
 DELETE_LOCKS_OLDER_THAN_SECONDS = 600
 QUEUE = getattr(settings, 'DJANGAE_CLEANUP_LOCKS_QUEUE', 'default')
 
+# The number of stale locks to read (keys-only) and delete at a time
+CLEANUP_BATCH_SIZE = 500
+# How long a cleanup task runs before deferring a new one to continue
+CLEANUP_TIME_BUDGET_SECONDS = 5 * 60
+# If there are at least this many stale locks, split the cleanup into CLEANUP_SHARD_COUNT tasks
+CLEANUP_SHARD_THRESHOLD = 10 * CLEANUP_BATCH_SIZE
+CLEANUP_SHARD_COUNT = 10
+
+# How long the running totals of a sharded cleanup are kept for
+CLEANUP_STATS_TIMEOUT = 24 * 60 * 60
+
 
 def cleanup_locks(request):
     """ Delete all Lock objects that are older than 10 minutes. """
@@ -30,17 +48,134 @@ def cleanup_locks(request):
     return HttpResponse("Cleanup locks task is running")
 
 
-def cleanup_locks_task():
-    """ Task function that deletes lock objects that are older than 10 minutes.
-        Due to its restriction of not being able to use an inequality filter, we can' use
-        defer_iteration for this, but if we can't delete all the objects in this one task then it
-        will just fail and retry, and everntually it will get through all of them.
+def _stats_keys(cut_off):
+    return (
+        "djangae-lock-cleanup-deleted:%s" % cut_off.isoformat(),
+        "djangae-lock-cleanup-shards:%s" % cut_off.isoformat(),
+    )
+
+
+def _shard_finished(cut_off, deleted):
+    """ Adds the locks deleted by a shard to the running total of its cleanup, and returns
+        the total if this was the last shard to finish (otherwise None).
     """
-    logger.info("Starting djangae.contrib.lock cleanup task")
-    cut_off = timezone.now() - timezone.timedelta(seconds=DELETE_LOCKS_OLDER_THAN_SECONDS)
+    deleted_key, shards_key = _stats_keys(cut_off)
+
+    try:
+        total = cache.incr(deleted_key, deleted)
+        remaining = cache.decr(shards_key)
+    except ValueError:
+        # The totals have expired (or were evicted), so we can't tell
+        logger.warning("Lost track of the number of locks deleted by the djangae.contrib.lock cleanup task")
+        return None
+
+    if remaining > 0:
+        return None
+
+    cache.delete_many([deleted_key, shards_key])
+    return total
+
+
+def cleanup_locks_task(
+    cut_off=None, start=None, end=None, sharded=False, deleted=0, skipped=0, shard_stats=False, resume_from=None
+):
+    """ Task function that deletes lock objects that are older than 10 minutes, unless their
+        lease hasn't expired yet.
+        The keys of stale locks are read in batches of CLEANUP_BATCH_SIZE, and the locks fetched by
+        key so that their timestamp and lease can be checked before they're deleted concurrently.
+        If the task runs for longer than CLEANUP_TIME_BUDGET_SECONDS, it defers another task to
+        continue from where it left off. If there's a large backlog of stale locks then the work is
+        first split into shards of timestamp ranges, each of which is processed by its own task, and
+        the total deleted is logged when the last shard finishes.
+        `start` and `end` are the (inclusive, exclusive) timestamp range of the current shard, and
+        `resume_from` is the timestamp to continue from, with the keys of the locks already skipped
+        at that timestamp.
+    """
+    from djangae.tasks.deferred import defer
+
+    task_start = time.time()
+
+    if cut_off is None:
+        logger.info("Starting djangae.contrib.lock cleanup task")
+        cut_off = timezone.now() - timezone.timedelta(seconds=DELETE_LOCKS_OLDER_THAN_SECONDS)
+
     queryset = DatastoreLock.objects.filter(timestamp__lt=cut_off)
-    queryset.delete()
-    logger.info("Finished djangae.contrib.lock cleanup task")
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+
+    if not sharded:
+        backlog = len(queryset.order_by().values_list("pk", flat=True)[:CLEANUP_SHARD_THRESHOLD])
+        if backlog >= CLEANUP_SHARD_THRESHOLD:
+            ranges = find_ranges_for_field(queryset, "timestamp", CLEANUP_SHARD_COUNT)
+            logger.info("Large backlog of stale locks, splitting cleanup into %s shards", len(ranges))
+
+            deleted_key, shards_key = _stats_keys(cut_off)
+            cache.set_many({deleted_key: deleted, shards_key: len(ranges)}, CLEANUP_STATS_TIMEOUT)
+
+            for shard_start, shard_end in ranges:
+                defer(
+                    cleanup_locks_task, cut_off=cut_off, start=shard_start, end=shard_end, sharded=True,
+                    shard_stats=True, _queue=QUEUE
+                )
+            return deleted
+
+    # Only the keys are read, as reading the lease expiry as well would need a composite index.
+    # Locks with an unexpired lease are skipped but still match the query, so (like keyset
+    # batching) we continue from the last timestamp and skip the locks we've already seen with it
+    keys = queryset.order_by("timestamp", "pk").values_list("pk", flat=True)
+    last_timestamp, seen = resume_from or (None, ())
+    seen = set(seen)
+
+    while True:
+        qs = keys
+        if last_timestamp is not None:
+            qs = qs.filter(timestamp__gte=last_timestamp)
+
+        batch = [pk for pk in qs[:CLEANUP_BATCH_SIZE + len(seen)] if pk not in seen][:CLEANUP_BATCH_SIZE]
+
+        # The locks may have been released or acquired again since we read their keys
+        now = timezone.now()
+        locks = [lock for lock in DatastoreLock.objects.in_bulk(batch).values() if lock.timestamp < cut_off]
+        stale = set(lock.pk for lock in locks if lock.expires is None or lock.expires < now)
+        skipped += len(locks) - len(stale)
+
+        if stale:
+            deleted += bulk_delete(list(stale), model=DatastoreLock)
+
+        if len(batch) < CLEANUP_BATCH_SIZE:
+            break
+
+        if locks:
+            timestamp = max(lock.timestamp for lock in locks)
+            if timestamp != last_timestamp:
+                seen = set()
+
+            last_timestamp = timestamp
+            seen.update(lock.pk for lock in locks if lock.timestamp == timestamp and lock.pk not in stale)
+
+        if time.time() - task_start > CLEANUP_TIME_BUDGET_SECONDS:
+            logger.info("Deleted %s stale locks so far, continuing cleanup in a new task", deleted)
+            defer(
+                cleanup_locks_task, cut_off=cut_off, start=start, end=end, sharded=True, deleted=deleted,
+                skipped=skipped, shard_stats=shard_stats, resume_from=(last_timestamp, sorted(seen)),
+                _queue=QUEUE
+            )
+            return deleted
+
+    if skipped:
+        logger.info("Skipped %s stale locks whose lease hasn't expired", skipped)
+
+    if shard_stats:
+        logger.info("Finished djangae.contrib.lock cleanup shard, deleted %s locks", deleted)
+        total = _shard_finished(cut_off, deleted)
+        if total is not None:
+            logger.info("Finished djangae.contrib.lock cleanup task, deleted %s locks", total)
+    else:
+        logger.info("Finished djangae.contrib.lock cleanup task, deleted %s locks", deleted)
+
+    return deleted
 
 
 def _delete_lock(lock):
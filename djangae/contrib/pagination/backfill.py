@@ -0,0 +1,132 @@
+import logging
+import time
+
+from gcloudc.db import transaction
+from gcloudc.db.models.fields.computed import ComputedCharField
+
+from djangae.processing import (
+    MAX_ENTITIES_PER_COMMIT,
+    _chunks,
+    _run_chunks,
+    find_key_ranges_for_queryset,
+)
+
+logger = logging.getLogger(__name__)
+
+# The number of instances to read (and then save, if they need it) at a time
+BACKFILL_BATCH_SIZE = 500
+# How long a backfill task runs before deferring a new one to continue
+BACKFILL_TIME_BUDGET_SECONDS = 5 * 60
+BACKFILL_SHARD_COUNT = 10
+
+
+def _pagination_fields(model):
+    return [
+        field for field in model._meta.fields
+        if field.name.startswith("pagination_") and isinstance(field, ComputedCharField)
+    ]
+
+
+def _needs_backfill(instance, fields):
+    """
+        Returns True if any of the pagination fields of the instance are missing, or
+        out of date (e.g. because the ordering was added after the instance was saved)
+    """
+    needed = False
+    for field in fields:
+        stored = getattr(instance, field.attname)
+        # This recalculates the value, and sets it on the instance
+        if field.pre_save(instance, False) != stored:
+            needed = True
+    return needed
+
+
+def _backfill_instances(model, pks, fields, batch_size=MAX_ENTITIES_PER_COMMIT, workers=4):
+    """
+        Saves the pagination fields of the instances of `model` with the given `pks`, in
+        chunks of `batch_size` which are saved concurrently on `workers` threads.
+        Each instance is read again in the transaction which saves it, and its fields are
+        computed from that copy, so edits made since the batch was read aren't overwritten
+        and are reflected in the pagination fields. Returns the number of instances saved.
+    """
+    field_names = [field.name for field in fields]
+
+    def backfill(chunk):
+        @transaction.atomic(xg=True)
+        def save():
+            instances = [
+                x for x in model._default_manager.in_bulk(chunk).values() if _needs_backfill(x, fields)
+            ]
+            for instance in instances:
+                instance.save(update_fields=field_names)
+            return len(instances)
+
+        return save()
+
+    return sum(_run_chunks(backfill, _chunks(pks, batch_size), workers))
+
+
+def backfill_pagination_task(model, start=None, end=None, queue="default", updated=0):
+    """
+        Task function which re-saves the instances of `model` (between the `start`
+        (inclusive) and `end` (exclusive) keys) whose pagination fields are missing or
+        out of date. Instances are read in batches of BACKFILL_BATCH_SIZE, and the ones
+        that need it are saved in batches. If the task runs for longer than
+        BACKFILL_TIME_BUDGET_SECONDS it defers another task to continue from where it
+        left off.
+    """
+    from djangae.tasks.deferred import defer
+
+    task_start = time.time()
+    fields = _pagination_fields(model)
+
+    queryset = model._default_manager.order_by("pk")
+    if end is not None:
+        queryset = queryset.filter(pk__lt=end)
+
+    batch_queryset = queryset if start is None else queryset.filter(pk__gte=start)
+
+    while True:
+        batch = list(batch_queryset[:BACKFILL_BATCH_SIZE])
+        updated += _backfill_instances(model, [x.pk for x in batch if _needs_backfill(x, fields)], fields)
+
+        if len(batch) < BACKFILL_BATCH_SIZE:
+            break
+
+        last_pk = batch[-1].pk
+        if time.time() - task_start > BACKFILL_TIME_BUDGET_SECONDS:
+            logger.info(
+                "Backfilled %s instances of %s so far, continuing in a new task", updated, model._meta.label
+            )
+            defer(
+                backfill_pagination_task, model, start=last_pk, end=end, queue=queue, updated=updated,
+                _queue=queue
+            )
+            return updated
+
+        batch_queryset = queryset.filter(pk__gt=last_pk)
+
+    logger.info("Finished backfilling shard of %s, updated %s instances", model._meta.label, updated)
+    return updated
+
+
+def _generate_backfill_shards(model, shards, queue):
+    from djangae.tasks.deferred import defer
+
+    for start, end in find_key_ranges_for_queryset(model._default_manager.all(), shards):
+        defer(backfill_pagination_task, model, start=start, end=end, queue=queue, _queue=queue)
+
+
+def backfill_pagination_fields(model, shards=BACKFILL_SHARD_COUNT, queue="default"):
+    """
+        Defers tasks which populate the pagination fields of any instances of `model`
+        which don't have them, e.g. after adding a new ordering to @paginated_model.
+        The instances are split into `shards` key ranges, which are processed concurrently,
+        and only the instances which need it are saved.
+    """
+    from djangae.tasks.deferred import defer
+
+    if not _pagination_fields(model):
+        raise ValueError("{} has no pagination fields".format(model._meta.label))
+
+    defer(_generate_backfill_shards, model, shards, queue, _queue=queue)
@@ -9,20 +9,41 @@ from django.db.models.fields import FieldDoesNotExist
 NULL_CHARACTER = u"\0"
 
 
-def generator(fields, instance):
+class _MirrorTable(dict):
     """
-        Calculates the value needed for a unique ordered representation of the fields
-        we are paginating.
+        A str.translate table which maps each character to its mirror in the unicode
+        range, e.g. first unicode char => last unicode char, etc. Entries are added
+        as they're needed.
     """
-    values = []
+    def __missing__(self, ordinal):
+        ret = self[ordinal] = chr(0xffff - ordinal)
+        return ret
+
+
+_MIRROR_TABLE = _MirrorTable()
+
+
+def _accessors(opts, fields):
+    """
+        Returns a tuple of (attname, negated) for each of the fields we are paginating
+    """
+    accessors = []
     for field in fields:
         neg = field.startswith("-")
 
         # If the field we have to paginate by is the pk, get the pk field name.
-        if field == 'pk':
-            field = instance._meta.pk.name
+        name = field.lstrip("-")
+        if name == 'pk':
+            name = opts.pk.name
 
-        value = instance._meta.get_field(field.lstrip("-")).value_from_object(instance)
+        accessors.append((opts.get_field(name).attname, neg))
+    return tuple(accessors)
+
+
+def _generate(accessors, instance):
+    values = []
+    for attname, neg in accessors:
+        value = getattr(instance, attname)
 
         if hasattr(value, "isoformat"):
             value = value.isoformat()
@@ -31,8 +52,8 @@ def generator(fields, instance):
 
         if neg:
             # this creates the alphabetical mirror of a string, e.g. ab => zy, but for the full
-            # range of unicode characters, e.g. first unicode char => last unicode char, etc
-            value = u"".join([chr(0xffff - ord(x)) for x in value])
+            # range of unicode characters
+            value = value.translate(_MIRROR_TABLE)
         values.append(value)
 
     values.append(str(instance.pk) if instance.pk else str(random.randint(0, 1000000000)))
@@ -40,6 +61,14 @@ def generator(fields, instance):
     return NULL_CHARACTER.join(values)
 
 
+def generator(fields, instance):
+    """
+        Calculates the value needed for a unique ordered representation of the fields
+        we are paginating.
+    """
+    return _generate(_accessors(instance._meta, fields), instance)
+
+
 def _field_name_for_ordering(ordering):
     names = []
 
@@ -90,8 +119,9 @@ class PaginatedModel(object):
             try:
                 cls._meta.get_field(new_field_name)
             except FieldDoesNotExist:
+                # Look up the fields once, rather than every time the value is calculated
                 ComputedCharField(
-                    partial(generator, ordering), max_length=500, editable=False
+                    partial(_generate, _accessors(cls._meta, ordering)), max_length=500, editable=False
                 ).contribute_to_class(cls, new_field_name)
 
         return cls
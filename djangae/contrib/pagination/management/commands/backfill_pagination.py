@@ -0,0 +1,36 @@
+from django.apps import apps
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from djangae.contrib.pagination.backfill import (
+    BACKFILL_SHARD_COUNT,
+    backfill_pagination_fields,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Defers tasks which populate the pagination fields of any instances of the given "
+        "@paginated_model models which are missing them (e.g. after adding a new ordering)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='+', help="Models to backfill, as app_label.ModelName")
+        parser.add_argument('--shards', type=int, default=BACKFILL_SHARD_COUNT)
+        parser.add_argument('--queue', default='default')
+
+    def handle(self, *args, **options):
+        for label in options['models']:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+
+            try:
+                backfill_pagination_fields(model, shards=options['shards'], queue=options['queue'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write("Deferred backfill of pagination fields for {}".format(model._meta.label))
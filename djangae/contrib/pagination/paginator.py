@@ -1,10 +1,22 @@
+import time
+import weakref
 from hashlib import md5
 from django.conf import settings
 from django.db import models, router
 from django.core import paginator
-from django.core.cache import cache
+from django.db.models.lookups import Lookup
+from django.db.models.sql.where import (
+    NothingNode,
+    WhereNode,
+)
 
 from djangae.contrib.pagination.decorators import _field_name_for_ordering
+from djangae.contrib.pagination.stores import marker_store
+from djangae.processing import (
+    _run_chunks,
+    find_ranges_for_field,
+)
+from djangae.utils import seek_filter
 from gcloudc.db.backends.datastore.query import extract_ordering
 
 
@@ -12,6 +24,20 @@ from gcloudc.db.backends.datastore.query import extract_ordering
 # the cache time.  That would allow different cache times for different queries.
 CACHE_TIME = getattr(settings, "DJANGAE_PAGINATION_CACHE_TIME", 30 * 60)
 
+# The number of pages to look back for a marker in the first get_many, and how
+# much to grow each subsequent window by
+MARKER_WINDOW_SIZE = 10
+MARKER_WINDOW_GROWTH = 10
+
+# The number of shards (and threads) used to count queries in the background
+COUNT_SHARD_COUNT = 10
+
+# How long a background task stores the markers of a shard before deferring a new one to continue
+COUNT_TIME_BUDGET_SECONDS = 5 * 60
+
+# The maximum number of markers written to the store at once by the background tasks
+MARKER_FLUSH_SIZE = 500
+
 
 class PaginationOrderingRequired(RuntimeError):
     pass
@@ -27,35 +53,75 @@ def _count_cache_key(query_id):
     return cache_key
 
 
-def _update_known_count(query_id, count):
-    cache_key = _count_cache_key(query_id)
+def _count_job_cache_key(query_id):
+    cache_key = "_PAGE_COUNT_JOB_{}".format(query_id)
+    return cache_key
+
 
-    ret = cache.get(cache_key)
-    if ret and ret > count:
-        return
+def _page_keys_cache_key(query_id, per_page, page_number):
+    cache_key = "_PAGE_KEYS_{}:{}:{}".format(query_id, per_page, page_number)
+    return cache_key
 
-    cache.set(cache_key, count, CACHE_TIME)
 
+def _get_known_count(query_id, shared=False):
+    """
+        Returns the highest count seen for the query. If `shared` is True, any in-process
+        copy of the count (which may be out of date) is bypassed.
+    """
+    store = marker_store()
+    get_many = getattr(store, "get_many_shared", store.get_many) if shared else store.get_many
 
-def _get_known_count(query_id):
     cache_key = _count_cache_key(query_id)
-    ret = cache.get(cache_key)
+    ret = get_many([cache_key]).get(cache_key)
     if ret:
         return ret
     return 0
 
 
-def _store_marker(query_id, page_number, marker_value):
+def _start_count_job(query_id):
     """
-        For a model and query id, stores the marker value for previously
-        queried page number.
+        Returns True if the background count of the query should be started, i.e. this
+        is the first time it has been seen since the count was last cached.
+    """
+    store = marker_store()
+    cache_key = _count_job_cache_key(query_id)
+
+    if hasattr(store, "add"):
+        return store.add(cache_key, True, CACHE_TIME)
+
+    # Without an atomic add, two instances may occasionally both start counting the query
+    get_many = getattr(store, "get_many_shared", store.get_many)
+    if get_many([cache_key]).get(cache_key):
+        return False
+
+    store.set_many({cache_key: True}, CACHE_TIME)
+    return True
+
 
-        This stores the last item on the page identified by page number,
-        not the marker that starts the page. i.e. there is a marker for page 1
+def _store_markers_and_count(query_id, markers, count, page_keys=None, per_page=None):
     """
+        Stores the end-of-page markers for several pages ({page_number: marker_value})
+        and updates the known count for the query, in a single cache round trip
+        (plus a read of the current count).
+
+        If passed, the primary keys of the results on each page ({page_number: [pk, ...]})
+        are stored in the same round trip.
+    """
+
+    values = {
+        _marker_cache_key(query_id, page_number): marker_value
+        for page_number, marker_value in markers.items()
+    }
+
+    for page_number, keys in (page_keys or {}).items():
+        values[_page_keys_cache_key(query_id, per_page, page_number)] = keys
 
-    cache_key = _marker_cache_key(query_id, page_number)
-    cache.set(cache_key, marker_value, CACHE_TIME)
+    # Other instances may have seen more results since our local copy of the count was cached
+    if count > _get_known_count(query_id, shared=True):
+        values[_count_cache_key(query_id)] = count
+
+    if values:
+        marker_store().set_many(values, CACHE_TIME)
 
 
 def _get_marker(query_id, page_number):
@@ -64,36 +130,237 @@ def _get_marker(query_id, page_number):
         previous page. Returns a tuple of (marker, pages) where pages is
         the number of pages we had to go back to find the marker (this is the
         number of pages we need to skip in the result set)
+
+        Markers are fetched with get_many in windows of pages which grow
+        exponentially, so that finding the nearest marker takes few round trips
+        even when jumping a long way past the last known marker.
     """
 
     counter = page_number - 1
-    pages_skipped = 0
+    window = MARKER_WINDOW_SIZE
 
     while counter > 0:
-        cache_key = _marker_cache_key(query_id, counter)
-        ret = cache.get(cache_key)
+        page_numbers = range(counter, max(counter - window, 0), -1)
+        cache_keys = [_marker_cache_key(query_id, x) for x in page_numbers]
+        ret = marker_store().get_many(cache_keys)
 
-        if ret:
-            return ret, pages_skipped
+        for number, cache_key in zip(page_numbers, cache_keys):
+            if ret.get(cache_key):
+                return ret[cache_key], page_number - 1 - number
 
-        counter -= 1
-        pages_skipped += 1
+        counter -= window
+        window *= MARKER_WINDOW_GROWTH
 
     # If we get here then we couldn't find a stored marker anywhere
-    return None, pages_skipped
+    return None, max(page_number - 1, 0)
+
+
+def _shard_queryset(queryset, field, start, end):
+    filter_kwargs = {}
+    if start is not None:
+        filter_kwargs["{}__gte".format(field)] = start
+
+    if end is not None:
+        filter_kwargs["{}__lt".format(field)] = end
+
+    return queryset.filter(**filter_kwargs)
+
+
+def _compute_exact_count(model, query, query_id, field, per_page, descending):
+    """
+        Deferred task which counts the results of a paginated query, and defers a
+        task for each range of the pagination field to store the marker for every
+        page boundary in it.
+
+        The model and query are passed rather than the queryset, as pickling a
+        queryset evaluates it.
+
+        The query is split into ranges of the pagination field, which are counted
+        concurrently. This gives the offset of each range in the results, so that
+        the markers of the ranges can be found independently.
+    """
+    from djangae.tasks.deferred import defer
+
+    queryset = model.objects.all()
+    queryset.query = query
+
+    ranges = find_ranges_for_field(queryset, field, COUNT_SHARD_COUNT)
+    if descending:
+        ranges = ranges[::-1]
+
+    def count(shard_range):
+        return _shard_queryset(queryset, field, *shard_range).count()
+
+    counts = _run_chunks(count, ranges, COUNT_SHARD_COUNT)
+
+    offset = 0
+    for (start, end), shard_count in zip(ranges, counts):
+        if shard_count:
+            defer(_store_shard_markers, model, query, query_id, field, per_page, descending, start, end, offset)
+        offset += shard_count
+
+    # This is an exact count, so it replaces (rather than only increasing) the known count
+    marker_store().set_many({_count_cache_key(query_id): offset}, CACHE_TIME)
+
+
+def _store_shard_markers(
+    model, query, query_id, field, per_page, descending, start, end, position, resume_from=None
+):
+    """
+        Deferred task which stores the markers at the page boundaries within a range
+        of the pagination field, reading (projecting) only the pagination field.
+        `position` is the number of results which come before the range (or before
+        `resume_from`).
+
+        Markers are written in chunks of MARKER_FLUSH_SIZE, and if the task runs for
+        longer than COUNT_TIME_BUDGET_SECONDS it defers another to continue from where
+        it left off. `resume_from` is the last value read, and the number of results
+        with that value which have already been read.
+    """
+    from djangae.tasks.deferred import defer
+
+    task_start = time.time()
+
+    queryset = model.objects.all()
+    queryset.query = query
+
+    values = _shard_queryset(queryset, field, start, end).order_by(
+        "-" + field if descending else field
+    ).values_list(field, flat=True)
+
+    last_value, repeats = resume_from or (None, 0)
+    if last_value is not None:
+        # The field may not be unique, so continue from (and including) the last value, and
+        # skip the results with that value which have already been read
+        values = values.filter(**{"{}__{}".format(field, "lte" if descending else "gte"): last_value})
+
+    skip = repeats
+    markers = {}
+    for value in values.iterator():
+        if skip:
+            skip -= 1
+            continue
+
+        position += 1
+        repeats = repeats + 1 if value == last_value else 1
+        last_value = value
+
+        if position % per_page == 0:
+            markers[_marker_cache_key(query_id, position // per_page)] = value
+
+        if len(markers) >= MARKER_FLUSH_SIZE:
+            marker_store().set_many(markers, CACHE_TIME)
+            markers = {}
+
+        if time.time() - task_start > COUNT_TIME_BUDGET_SECONDS:
+            defer(
+                _store_shard_markers, model, query, query_id, field, per_page, descending, start, end,
+                position, resume_from=(last_value, repeats)
+            )
+            break
+
+    if markers:
+        marker_store().set_many(markers, CACHE_TIME)
+
+
+class _NoFingerprint(Exception):
+    pass
+
+
+def _value_fingerprint(value):
+    if hasattr(value, "resolve_expression"):
+        # Expressions and subqueries
+        raise _NoFingerprint()
+
+    if isinstance(value, (set, frozenset)):
+        # The iteration order of sets isn't stable across processes
+        value = sorted(value, key=repr)
+
+    ret = repr(value)
+    if " at 0x" in ret:
+        # The default object repr includes the memory address
+        raise _NoFingerprint()
+    return ret
+
+
+def _where_fingerprint(node):
+    if isinstance(node, NothingNode):
+        return ("NOTHING",)
+
+    if isinstance(node, WhereNode):
+        return (
+            node.connector,
+            node.negated,
+            tuple(_where_fingerprint(child) for child in node.children)
+        )
+
+    target = getattr(getattr(node, "lhs", None), "target", None)
+    if not isinstance(node, Lookup) or target is None:
+        raise _NoFingerprint()
+
+    return (node.lookup_name, node.lhs.alias, target.column, _value_fingerprint(node.rhs))
+
+
+def _query_fingerprint(query):
+    """
+        Returns a structural description of the query (model, filters, ordering and
+        selected columns, but not the low and high marks) which is stable across
+        processes, or raises _NoFingerprint if the query has parts we can't describe.
+    """
+    if query.annotations or query.extra or query.extra_order_by or query.combinator:
+        raise _NoFingerprint()
+
+    return (
+        query.model._meta.label,
+        _where_fingerprint(query.where),
+        tuple(_value_fingerprint(x) for x in query.order_by),
+        query.default_ordering,
+        query.standard_ordering,
+        query.distinct,
+        tuple(query.distinct_fields),
+        tuple(query.values_select),
+    )
+
+
+# Memoized identifiers, keyed by the id() of the query they were calculated for. Each
+# entry holds a weak reference to its query, as ids are reused once a query is freed
+_query_identifiers = {}
+
+
+def _forget_identifier(key, ref):
+    entry = _query_identifiers.get(key)
+    if entry is not None and entry[0] is ref:
+        _query_identifiers.pop(key, None)
 
 
 def queryset_identifier(queryset):
     """ Returns a string that uniquely identifies this query excluding its low and high mark"""
 
+    query = queryset.query
+
+    key = id(query)
+    cached = _query_identifiers.get(key)
+    if cached is not None and cached[0]() is query:
+        return cached[1]
+
     db_alias = router.db_for_read(queryset.model)
-    sql_and_params = u"%s:%s" % queryset.query.sql_with_params()
-    cache_key = u"%s:%s" % (db_alias, sql_and_params)
+
+    try:
+        fingerprint = repr(_query_fingerprint(query))
+    except _NoFingerprint:
+        # Fall back to compiling the query
+        fingerprint = u"%s:%s" % query.sql_with_params()
+
+    cache_key = u"%s:%s" % (db_alias, fingerprint)
     cache_key = cache_key.encode('utf-8')
 
     hasher = md5()
     hasher.update(cache_key)
-    return hasher.hexdigest()
+    identifier = hasher.hexdigest()
+
+    ref = weakref.ref(query, lambda ref: _forget_identifier(key, ref))
+    _query_identifiers[key] = (ref, identifier)
+    return identifier
 
 
 class Paginator(paginator.Paginator):
@@ -108,11 +375,15 @@ class Paginator(paginator.Paginator):
         per_page,
         readahead=10,
         allow_empty_first_page=True,
+        background_count=False,
+        cache_pages=False,
         **kwargs
     ):
         if not object_list.ordered:
             object_list.order_by("pk")  # Just order by PK by default
 
+        self.cache_pages = cache_pages
+
         self.original_orderings = extract_ordering(object_list.query)
         self.field_required = _field_name_for_ordering(self.original_orderings[:])
         self.readahead = readahead
@@ -147,10 +418,60 @@ class Paginator(paginator.Paginator):
             **kwargs
         )
 
+        # The first time we see this query, count it (and store all of its markers)
+        # in the background
+        if background_count and _start_count_job(self.queryset_id):
+            from djangae.tasks.deferred import defer
+            defer(
+                _compute_exact_count,
+                self.object_list.model,
+                self.object_list.query,
+                self.queryset_id,
+                self.field_required,
+                int(self.per_page),
+                len(self.original_orderings) == 1 and self.original_orderings[0].startswith("-")
+            )
+
     @property
     def count(self):
         return _get_known_count(self.queryset_id)
 
+    def _marker_for(self, instance):
+        """
+            Returns the marker to store for a page which ends with the given instance
+        """
+        return getattr(instance, self.field_required)
+
+    def _queryset_after(self, marker_value):
+        """
+            Returns the queryset of the results which come after the given marker
+        """
+        if len(self.original_orderings) == 1 and self.original_orderings[0].startswith("-"):
+            return self.object_list.all().filter(**{"{}__lt".format(self.field_required): marker_value})
+        else:
+            return self.object_list.all().filter(**{"{}__gt".format(self.field_required): marker_value})
+
+    def _get_cached_page(self, number):
+        """
+            Returns the page with the given number by fetching the instances whose keys
+            were cached by a previous call to page(), or None if they weren't
+        """
+        cache_key = _page_keys_cache_key(self.queryset_id, self.per_page, number)
+        keys = marker_store().get_many([cache_key]).get(cache_key)
+        if not keys:
+            return None
+
+        # Fetching through the queryset (rather than the model's manager) keeps its manager,
+        # only()/defer() and select_related(). The ordering is cleared as it comes from the keys
+        instances = self.object_list.order_by().in_bulk(keys)
+
+        # Instances may have been deleted (or no longer match) since their keys were cached
+        results = [instances[x] for x in keys if x in instances]
+        if not results and not self.allow_empty_first_page:
+            raise paginator.EmptyPage("That page contains no results")
+
+        return self._get_page(results, number, self)
+
     def validate_number(self, number):
         """
         Validates the given 1-based page number.
@@ -172,16 +493,18 @@ class Paginator(paginator.Paginator):
         bottom = (number - 1) * self.per_page
         top = bottom + self.per_page
 
+        if self.cache_pages:
+            page = self._get_cached_page(number)
+            if page is not None:
+                return page
+
         marker_value, pages = _get_marker(
             self.queryset_id,
             number
         )
 
         if marker_value:
-            if len(self.original_orderings) == 1 and self.original_orderings[0].startswith("-"):
-                qs = self.object_list.all().filter(**{"{}__lt".format(self.field_required): marker_value})
-            else:
-                qs = self.object_list.all().filter(**{"{}__gt".format(self.field_required): marker_value})
+            qs = self._queryset_after(marker_value)
             bottom = pages * self.per_page  # We have to skip the pages here
             top = bottom + self.per_page
         else:
@@ -189,6 +512,10 @@ class Paginator(paginator.Paginator):
 
         results = list(qs[bottom:top + (self.per_page * self.readahead)])
 
+        # Collect the markers for this page and the read-ahead pages, so that they can
+        # be written (along with the count) in one go
+        markers = {}
+
         next_page = results[top:]
         next_page_counter = number + 1
         while next_page:
@@ -196,20 +523,13 @@ class Paginator(paginator.Paginator):
                 index = self.per_page-1
             else:
                 index = len(next_page)-1
-            _store_marker(
-                self.queryset_id,
-                next_page_counter,
-                getattr(next_page[index], self.field_required)
-            )
+            markers[next_page_counter] = self._marker_for(next_page[index])
             next_page_counter += 1
             next_page = next_page[self.per_page:]
 
         if not results and not self.allow_empty_first_page:
             raise paginator.EmptyPage("That page contains no results")
 
-        known_count = ((number - 1) * self.per_page) + len(results)
-        _update_known_count(self.queryset_id, known_count)
-
         page = self._get_page(results[:self.per_page], number, self)
 
         if len(page.object_list) > self.per_page-1:
@@ -218,10 +538,92 @@ class Paginator(paginator.Paginator):
             index = len(page.object_list)-1
 
         if results:
-            _store_marker(
-                self.queryset_id,
-                number,
-                getattr(page.object_list[index], self.field_required)
-            )
+            markers[number] = self._marker_for(page.object_list[index])
+
+        page_keys = None
+        if self.cache_pages:
+            # Keep the keys of this page and the read-ahead pages, so that they can be
+            # fetched directly next time
+            page_keys = {
+                number + (i // self.per_page): [x.pk for x in results[i:i + self.per_page]]
+                for i in range(0, len(results), self.per_page)
+            }
+
+        known_count = ((number - 1) * self.per_page) + len(results)
+        _store_markers_and_count(
+            self.queryset_id, markers, known_count, page_keys=page_keys, per_page=self.per_page
+        )
 
         return page
+
+
+class CursorPaginator(Paginator):
+    """
+        A paginator which works with any ordering that the Datastore has an index for,
+        without the @paginated_model class decorator.
+
+        Rather than the value of a precalculated field, the marker stored for each page
+        is a cursor made up of the values of the ordering fields (and the pk) of the last
+        result on the page. Later pages are queried for the results which come after the
+        cursor, which is an OR query with a branch for each ordering field, so for long
+        orderings the precalculated fields used by Paginator are more efficient.
+    """
+
+    def __init__(
+        self,
+        object_list,
+        per_page,
+        readahead=10,
+        allow_empty_first_page=True,
+        cache_pages=False,
+        **kwargs
+    ):
+        if not object_list.ordered:
+            object_list = object_list.order_by("pk")  # Just order by PK by default
+
+        self.cache_pages = cache_pages
+
+        pk_name = object_list.model._meta.pk.name
+        pk_aliases = ("pk", "__key__", object_list.model._meta.pk.column)
+
+        self.original_orderings = []
+        for ordering in extract_ordering(object_list.query):
+            if ordering.lstrip("-") in pk_aliases:
+                ordering = ordering.replace(ordering.lstrip("-"), pk_name)
+            self.original_orderings.append(ordering)
+        self.readahead = readahead
+        self.allow_empty_first_page = allow_empty_first_page
+
+        # The pk makes the cursor unique, it goes in the same direction as the last
+        # ordering so that single field orderings can use the built-in indexes
+        self.cursor_orderings = list(self.original_orderings)
+        if pk_name not in [x.lstrip("-") for x in self.cursor_orderings]:
+            descending = bool(self.cursor_orderings) and self.cursor_orderings[-1].startswith("-")
+            self.cursor_orderings.append("-" + pk_name if descending else pk_name)
+
+        self._cursor_fields = [
+            object_list.model._meta.get_field(x.lstrip("-")) for x in self.cursor_orderings
+        ]
+
+        object_list = object_list.order_by(*self.cursor_orderings)
+
+        self.queryset_id = queryset_identifier(object_list)
+        super(Paginator, self).__init__(
+            object_list,
+            per_page,
+            allow_empty_first_page=allow_empty_first_page,
+            **kwargs
+        )
+
+    def _marker_for(self, instance):
+        return tuple(field.value_from_object(instance) for field in self._cursor_fields)
+
+    def _queryset_after(self, marker_value):
+        """
+            Returns the results which come after the cursor
+        """
+        query = seek_filter(self._cursor_fields, self.cursor_orderings, marker_value)
+        if query is None:
+            return self.object_list.none()
+
+        return self.object_list.all().filter(query)
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from djangae.core.signals import test_environment_reset
+
+DEFAULT_MARKER_STORE = "djangae.contrib.pagination.stores.TwoTierMarkerStore"
+
+# The maximum number of markers and counts kept in memory by each process, and for how long
+LOCAL_CACHE_SIZE = getattr(settings, "DJANGAE_PAGINATION_LOCAL_CACHE_SIZE", 1000)
+LOCAL_CACHE_TIME = getattr(settings, "DJANGAE_PAGINATION_LOCAL_CACHE_TIME", 60)
+
+
+class CacheMarkerStore(object):
+    """
+        Stores pagination markers and counts in a Django cache.
+
+        To use a different store, set DJANGAE_PAGINATION_MARKER_STORE to the path of
+        a class which implements get_many and set_many. Stores which keep copies of
+        entries in memory can also implement get_many_shared, which skips them, and
+        stores which can atomically add a key can implement add.
+    """
+
+    def __init__(self, cache_alias="default"):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        # Cache connections are per-thread, so look it up each time
+        return caches[self.cache_alias]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set(self, key, value, timeout):
+        self.set_many({key: value}, timeout)
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set_many(self, values, timeout):
+        self.cache.set_many(values, timeout)
+
+    def add(self, key, value, timeout):
+        return self.cache.add(key, value, timeout)
+
+    def get_many_shared(self, keys):
+        return self.cache.get_many(keys)
+
+
+class TwoTierMarkerStore(CacheMarkerStore):
+    """
+        A CacheMarkerStore with a bounded, in-process LRU in front of the cache. Writes
+        go to both, and reads are served from memory where possible.
+
+        Entries are only kept in memory for up to LOCAL_CACHE_TIME seconds, so counts
+        updated by other instances are picked up reasonably quickly.
+    """
+
+    def __init__(self, cache_alias="default", max_size=LOCAL_CACHE_SIZE, local_timeout=LOCAL_CACHE_TIME):
+        super().__init__(cache_alias)
+        self.max_size = max_size
+        self.local_timeout = local_timeout
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_local(self, keys):
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            for key in keys:
+                entry = self._local.get(key)
+                if entry is None:
+                    continue
+
+                value, expires = entry
+                if expires <= now:
+                    del self._local[key]
+                    continue
+
+                self._local.move_to_end(key)
+                found[key] = value
+
+        return found
+
+    def _set_local(self, values, timeout):
+        expires = time.time() + min(timeout or self.local_timeout, self.local_timeout)
+
+        with self._lock:
+            for key, value in values.items():
+                self._local[key] = (value, expires)
+                self._local.move_to_end(key)
+
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def get_many(self, keys):
+        found = self._get_local(keys)
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = super().get_many(missing)
+            self._set_local(fetched, self.local_timeout)
+            found.update(fetched)
+
+        return found
+
+    def set_many(self, values, timeout):
+        super().set_many(values, timeout)
+        self._set_local(values, timeout)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+
+_marker_store = None
+
+
+def marker_store():
+    """
+        Returns the store (set by DJANGAE_PAGINATION_MARKER_STORE) used for pagination
+        markers and counts
+    """
+    global _marker_store
+
+    if _marker_store is None:
+        _marker_store = import_string(
+            getattr(settings, "DJANGAE_PAGINATION_MARKER_STORE", DEFAULT_MARKER_STORE)
+        )()
+    return _marker_store
+
+
+def clear_local_markers():
+    """
+        Clears any markers and counts held in memory by this process
+    """
+    if _marker_store is not None and hasattr(_marker_store, "clear_local"):
+        _marker_store.clear_local()
+
+
+@receiver(test_environment_reset)
+def _reset_local_markers(sender, **kwargs):
+    clear_local_markers()
@@ -1,4 +1,8 @@
+import time
+
+from django.contrib.sessions.models import Session
 from django.core import paginator as django_paginator
+from django.core.cache import cache
 from django.db import models
 from django.utils.encoding import python_2_unicode_compatible
 
@@ -6,13 +10,23 @@ from djangae.test import TestCase
 from djangae.contrib import sleuth
 from djangae.contrib.pagination import (
     paginated_model,
+    CursorPaginator,
     Paginator,
     PaginationOrderingRequired
 )
 
+from . import backfill
+from .backfill import backfill_pagination_fields
+from .decorators import generator
+from .stores import (
+    TwoTierMarkerStore,
+    marker_store,
+)
 from .paginator import (
     queryset_identifier,
+    _count_cache_key,
     _get_marker,
+    _store_markers_and_count,
 )
 
 
@@ -71,6 +85,167 @@ class PaginatedModelTests(TestCase):
 
         self.assertEqual(u"Luke\x00{}\x001".format(reversed_last_name), user.pagination_first_name_neg_last_name)
 
+    def test_negated_non_ascii_values(self):
+        user = TestUser.objects.create(pk=1, first_name="Zoë", last_name="Ångström")
+
+        reversed_last_name = "".join([chr(0xffff - ord(x)) for x in "Ångström"])
+        self.assertEqual(u"Zoë\x00{}\x001".format(reversed_last_name), user.pagination_first_name_neg_last_name)
+        self.assertEqual(user.pagination_first_name_neg_last_name, generator(("first_name", "-last_name"), user))
+
+
+class BackfillTests(TestCase):
+    def test_missing_fields_backfilled(self):
+        u1 = TestUser.objects.create(id=1, first_name="A", last_name="A")
+        u2 = TestUser.objects.create(id=2, first_name="B", last_name="B")
+
+        # As if the ordering had been added after u1 was saved
+        TestUser.objects.filter(pk=u1.pk).update(pagination_first_name=None)
+
+        with sleuth.watch("djangae.contrib.pagination.backfill._backfill_instances") as backfill_instances:
+            backfill_pagination_fields(TestUser)
+            self.process_task_queues()
+
+        # Only the instance which needed it was saved
+        self.assertEqual([[u1.pk]], [call.args[1] for call in backfill_instances.calls if call.args[1]])
+        self.assertEqual([1], [count for count in backfill_instances.call_returns if count])
+
+        u1.refresh_from_db()
+        self.assertEqual(u"A\x001", u1.pagination_first_name)
+        self.assertEqual([u1, u2], list(Paginator(TestUser.objects.order_by("first_name"), 2).page(1).object_list))
+
+    def test_model_without_pagination_fields(self):
+        with self.assertRaises(ValueError):
+            backfill_pagination_fields(Session)
+
+    def test_concurrent_edits_not_overwritten(self):
+        u1 = TestUser.objects.create(id=1, first_name="A", last_name="A")
+        TestUser.objects.filter(pk=u1.pk).update(pagination_first_name=None)
+
+        needs_backfill = backfill._needs_backfill
+
+        def edit_then_check(instance, fields):
+            # Someone edits the instance after the backfill has read it
+            TestUser.objects.filter(pk=instance.pk).update(last_name="B")
+            return needs_backfill(instance, fields)
+
+        with sleuth.switch("djangae.contrib.pagination.backfill._needs_backfill", edit_then_check):
+            backfill_pagination_fields(TestUser)
+            self.process_task_queues()
+
+        # The edit is kept, and the pagination fields are computed from it rather than from the
+        # copy of the instance which the backfill read
+        u1.refresh_from_db()
+        self.assertEqual("B", u1.last_name)
+        reversed_last_name = "".join([chr(0xffff - ord(x)) for x in "B"])
+        self.assertEqual(u"A\x001", u1.pagination_first_name)
+        self.assertEqual(u"B\x001", u1.pagination_last_name)
+        self.assertEqual(u"A\x00B\x001", u1.pagination_first_name_last_name)
+        self.assertEqual(u"A\x00{}\x001".format(reversed_last_name), u1.pagination_first_name_neg_last_name)
+        self.assertEqual("%s\x001" % u1.created.isoformat(), u1.pagination_created)
+
+        # None of the pagination fields (including the ones for orderings not listed above) are out of date
+        self.assertFalse(backfill._needs_backfill(u1, backfill._pagination_fields(TestUser)))
+
+
+class TwoTierMarkerStoreTests(TestCase):
+    def test_reads_served_locally(self):
+        store = TwoTierMarkerStore()
+        store.set_many({"a": 1, "b": 2}, 60)
+
+        with sleuth.watch("django.core.cache.cache.get_many") as cache_get_many:
+            self.assertEqual({"a": 1, "b": 2}, store.get_many(["a", "b"]))
+            self.assertFalse(cache_get_many.called)
+
+            # Misses are fetched from the cache, and then kept locally
+            store.clear_local()
+            self.assertEqual({"a": 1, "b": 2}, store.get_many(["a", "b", "c"]))
+            self.assertEqual(1, cache_get_many.call_count)
+
+            self.assertEqual(1, store.get("a"))
+            self.assertEqual(1, cache_get_many.call_count)
+
+    def test_least_recently_used_evicted(self):
+        store = TwoTierMarkerStore(max_size=2)
+        store.set_many({"a": 1, "b": 2}, 60)
+        store.get("a")
+        store.set("c", 3, 60)
+
+        self.assertEqual({"a": 1, "c": 3}, store._get_local(["a", "b", "c"]))
+        # Evicted entries are still in the cache
+        self.assertEqual(2, store.get("b"))
+
+    def test_local_entries_expire(self):
+        store = TwoTierMarkerStore(local_timeout=0.01)
+        store.set("a", 1, 60)
+        time.sleep(0.02)
+
+        self.assertEqual({}, store._get_local(["a"]))
+        self.assertEqual(1, store.get("a"))
+
+    def test_count_checked_against_cache(self):
+        cache_key = _count_cache_key("query")
+        marker_store().set_many({cache_key: 10}, 60)
+
+        # Another instance has seen more results since the count was kept locally
+        cache.set(cache_key, 20)
+        _store_markers_and_count("query", {}, 15)
+
+        self.assertEqual(20, cache.get(cache_key))
+
+
+class QuerysetIdentifierTests(TestCase):
+    def test_identifier_is_structural(self):
+        queryset = TestUser.objects.filter(first_name="A").order_by("last_name")
+
+        with sleuth.watch("django.db.models.sql.query.Query.sql_with_params") as sql_with_params:
+            identifier = queryset_identifier(queryset)
+
+            # Equivalent querysets have the same identifier, regardless of slicing
+            self.assertEqual(
+                identifier, queryset_identifier(TestUser.objects.filter(first_name="A").order_by("last_name")[5:10])
+            )
+            self.assertNotEqual(identifier, queryset_identifier(queryset.filter(last_name="B")))
+            self.assertNotEqual(identifier, queryset_identifier(queryset.order_by("-last_name")))
+            self.assertNotEqual(
+                identifier, queryset_identifier(TestUser.objects.filter(first_name="B").order_by("last_name"))
+            )
+
+        # The query didn't need to be compiled
+        self.assertFalse(sql_with_params.called)
+
+    def test_identifier_memoized(self):
+        queryset = TestUser.objects.filter(first_name="A")
+        identifier = queryset_identifier(queryset)
+
+        with sleuth.watch("djangae.contrib.pagination.paginator._query_fingerprint") as fingerprint:
+            self.assertEqual(identifier, queryset_identifier(queryset))
+            self.assertFalse(fingerprint.called)
+
+            # Clones copy the memoized identifier, but mustn't use it
+            self.assertNotEqual(identifier, queryset_identifier(queryset.filter(last_name="A")))
+            self.assertTrue(fingerprint.called)
+
+    def test_identifier_not_reused_for_new_query_at_same_address(self):
+        identified = set()
+        reused = False
+
+        for i in range(3000):
+            queryset = TestUser.objects.filter(first_name=str(i))
+            queryset_identifier(queryset)
+            identified.add(id(queryset.query))
+
+            # Each clone is made while the previous query is still alive, but that query
+            # is then freed, so the next clone is often allocated at its address
+            queryset = queryset.filter(last_name="A")
+            queryset = queryset.filter(last_name="B")
+            reused = reused or id(queryset.query) in identified
+
+            fresh = TestUser.objects.filter(first_name=str(i)).filter(last_name="A").filter(last_name="B")
+            self.assertEqual(queryset_identifier(fresh), queryset_identifier(queryset))
+
+        # Make sure we actually tested what we meant to
+        self.assertTrue(reused)
+
 
 class DatastorePaginatorTests(TestCase):
     def setUp(self):
@@ -168,6 +343,125 @@ class DatastorePaginatorTests(TestCase):
 
         self.assertEqual(expected_markers, actual_markers)
 
+    def test_distant_marker_found_in_few_round_trips(self):
+        paginator = Paginator(TestUser.objects.all().order_by("first_name"), 1, readahead=0)
+        paginator.page(1)
+
+        with sleuth.watch("django.core.cache.cache.get_many") as cache_get_many:
+            marker, pages = _get_marker(paginator.queryset_id, 500)
+
+        self.assertEqual(paginator.page(1).object_list[0].pagination_first_name, marker)
+        self.assertEqual(498, pages)
+        # Windows of 10, 100 and then 1000 pages
+        self.assertEqual(3, cache_get_many.call_count)
+
+        self.assertEqual((None, 0), _get_marker(paginator.queryset_id, 1))
+
+    def test_markers_and_count_written_in_one_batch(self):
+        paginator = Paginator(TestUser.objects.all().order_by("first_name"), 1, readahead=4)
+
+        with sleuth.watch("django.core.cache.cache.set") as cache_set:
+            with sleuth.watch("django.core.cache.cache.set_many") as cache_set_many:
+                paginator.page(1)
+
+        self.assertFalse(cache_set.called)
+        self.assertEqual(1, cache_set_many.call_count)
+        self.assertEqual(4, paginator.count)
+
+    def test_background_count_does_not_evaluate_queryset(self):
+        with sleuth.watch("django.db.models.query.QuerySet._fetch_all") as fetch_all:
+            with sleuth.watch("djangae.tasks.deferred.defer") as defer:
+                Paginator(TestUser.objects.order_by("first_name"), 1, background_count=True)
+
+        self.assertTrue(defer.called)
+        # Pickling a queryset for the task would load every result of the query
+        self.assertFalse(fetch_all.called)
+        self.assertFalse(any(isinstance(x, models.QuerySet) for x in defer.calls[0].args))
+
+    def test_background_count(self):
+        for ordering, expected in (("first_name", "B"), ("-first_name", "A")):
+            paginator = Paginator(TestUser.objects.order_by(ordering), 1, readahead=0, background_count=True)
+            self.assertEqual(0, paginator.count)
+
+            with sleuth.watch("djangae.tasks.deferred.defer") as defer:
+                # The count is only computed the first time the query is seen
+                Paginator(TestUser.objects.order_by(ordering), 1, readahead=0, background_count=True)
+            self.assertFalse(defer.called)
+
+            self.process_task_queues()
+            self.assertEqual(4, paginator.count)
+
+            # Markers are stored for every page, so we can jump straight to the end
+            marker, pages = _get_marker(paginator.queryset_id, 4)
+            self.assertEqual(0, pages)
+            self.assertEqual(expected, paginator.page(4).object_list[0].first_name)
+
+    def test_background_count_continues_in_new_tasks(self):
+        # With no time budget, each marker is stored (and flushed) by a new task
+        with sleuth.switch("djangae.contrib.pagination.paginator.COUNT_SHARD_COUNT", 1):
+            with sleuth.switch("djangae.contrib.pagination.paginator.COUNT_TIME_BUDGET_SECONDS", 0):
+                with sleuth.switch("djangae.contrib.pagination.paginator.MARKER_FLUSH_SIZE", 1):
+                    with sleuth.watch("djangae.tasks.deferred.defer") as defer:
+                        paginator = Paginator(
+                            TestUser.objects.order_by("first_name"), 1, readahead=0, background_count=True
+                        )
+                        self.process_task_queues()
+
+        self.assertTrue(any(call.kwargs.get("resume_from") for call in defer.calls))
+        self.assertEqual(4, paginator.count)
+
+        users = [self.u1, self.u2, self.u3, self.u4]
+        for number, user in enumerate(users[1:], start=2):
+            marker, pages = _get_marker(paginator.queryset_id, number)
+            self.assertEqual(0, pages)
+            self.assertEqual(user, paginator.page(number).object_list[0])
+
+    def test_background_count_started_once_by_the_store(self):
+        with sleuth.watch("djangae.contrib.pagination.stores.CacheMarkerStore.add") as add:
+            Paginator(TestUser.objects.order_by("first_name"), 1, background_count=True)
+            Paginator(TestUser.objects.order_by("first_name"), 1, background_count=True)
+
+        self.assertEqual([True, False], add.call_returns)
+
+    def test_cache_pages(self):
+        paginator = Paginator(TestUser.objects.order_by("first_name"), 2, readahead=1, cache_pages=True)
+        self.assertEqual([self.u1, self.u2], list(paginator.page(1).object_list))
+
+        # The read-ahead page is fetched by key, without querying
+        with sleuth.watch("djangae.contrib.pagination.paginator._get_marker") as get_marker:
+            self.assertEqual([self.u3, self.u4], list(paginator.page(2).object_list))
+        self.assertFalse(get_marker.called)
+
+        # Deleted instances are skipped
+        self.u1.delete()
+        self.assertEqual([self.u2], list(paginator.page(1).object_list))
+
+        # Instances are fetched through the queryset, so only() etc. still apply
+        paginator = Paginator(
+            TestUser.objects.only("first_name").order_by("first_name"), 2, readahead=1, cache_pages=True
+        )
+        paginator.page(1)
+        with sleuth.watch("djangae.contrib.pagination.paginator._get_marker") as get_marker:
+            cached = list(paginator.page(2).object_list)
+        self.assertFalse(get_marker.called)
+        self.assertTrue(cached)
+        self.assertIn("last_name", cached[0].get_deferred_fields())
+
+        # Cached pages which are now empty are treated like any other empty page
+        paginator = Paginator(
+            TestUser.objects.order_by("first_name"), 2, readahead=1, cache_pages=True, allow_empty_first_page=False
+        )
+        paginator.page(1)
+        TestUser.objects.filter(pk__in=[self.u3.pk, self.u4.pk]).delete()
+        with self.assertRaises(django_paginator.EmptyPage):
+            paginator.page(2)
+
+        # Pages aren't cached unless asked for
+        paginator = Paginator(TestUser.objects.order_by("first_name"), 2, readahead=1)
+        with sleuth.watch("djangae.contrib.pagination.paginator._get_marker") as get_marker:
+            self.assertEqual([self.u3, self.u4], list(paginator.page(2).object_list))
+        self.assertTrue(get_marker.called)
+
     def test_ordering_required_exception_is_thrown_when_no_order_specified(self):
         # The exception should not be thrown when an order is specified
         query_set = SimpleModelWithoutOrdering.objects.order_by("name")
@@ -230,3 +524,44 @@ class DatastorePaginatorTests(TestCase):
 
         paginator = Paginator(TestUser.objects.all().order_by("-first_name"), 1)
         self.assertEqual(paginator.page(5).object_list, [])
+
+
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        super(CursorPaginatorTests, self).setUp()
+
+        self.u1 = TestUser.objects.create(id=1, first_name="A", last_name="A")
+        self.u2 = TestUser.objects.create(id=2, first_name="A", last_name="B")
+        self.u3 = TestUser.objects.create(id=3, first_name="B", last_name="A")
+        self.u4 = TestUser.objects.create(id=4, first_name="B", last_name="B")
+
+    def test_pages_correct(self):
+        # No pagination field is needed for this ordering
+        paginator = CursorPaginator(TestUser.objects.order_by("last_name", "first_name"), 1, readahead=1)
+        self.assertEqual(
+            [self.u1, self.u3, self.u2, self.u4],
+            [paginator.page(i).object_list[0] for i in range(1, 5)]
+        )
+
+        paginator = CursorPaginator(TestUser.objects.order_by("first_name", "-last_name"), 1, readahead=1)
+        self.assertEqual(
+            [self.u2, self.u1, self.u4, self.u3],
+            [paginator.page(i).object_list[0] for i in range(1, 5)]
+        )
+
+        paginator = CursorPaginator(TestUser.objects.order_by("-first_name"), 3)
+        self.assertEqual([self.u4, self.u3, self.u2], list(paginator.page(1).object_list))
+        self.assertEqual([self.u1], list(paginator.page(2).object_list))
+
+    def test_cursor_stored(self):
+        paginator = CursorPaginator(TestUser.objects.order_by("first_name"), 1, readahead=1)
+        paginator.page(1)
+
+        # The cursor is the ordering values and the pk of the last result on each page
+        self.assertEqual(("A", 1), _get_marker(paginator.queryset_id, 2)[0])
+        self.assertEqual(("A", 2), _get_marker(paginator.queryset_id, 3)[0])
+
+        with sleuth.watch("djangae.contrib.pagination.paginator._get_marker") as get_marker:
+            self.assertEqual(self.u3, paginator.page(3).object_list[0])
+
+        self.assertEqual(0, get_marker.call_returns[0][1])
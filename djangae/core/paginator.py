@@ -1,7 +1,25 @@
 import collections
+import datetime
 
+from django.core import signing
+from django.core.paginator import InvalidPage, PageNotAnInteger, EmptyPage
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import six
-from django.core.paginator import PageNotAnInteger, EmptyPage
+
+from djangae.utils import seek_filter
+
+
+class _TokenEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates to milliseconds, but we need the exact value to seek from
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class _TokenSerializer(signing.JSONSerializer):
+    def dumps(self, obj):
+        return _TokenEncoder(separators=(",", ":")).encode(obj).encode("latin-1")
 
 
 class DatastorePaginator(object):
@@ -14,11 +32,49 @@ class DatastorePaginator(object):
 
     NOT_SUPPORTED_MSG = "Property '{}' is not supported when paginating datastore-models"
 
+    TOKEN_SALT = "djangae.core.paginator"
+
     def __init__(self, object_list, per_page, orphans=0,
-                 allow_empty_first_page=True):
-        self.object_list = object_list
+                 allow_empty_first_page=True, seek=False):
         self.per_page = int(per_page)
         self.allow_empty_first_page = allow_empty_first_page
+        self.seek = seek
+
+        if seek:
+            # The ordering (made unique by the pk) of the query is what the tokens encode
+            self._orderings = self._seek_orderings(object_list)
+            self._fields = [
+                object_list.model._meta.get_field(x.lstrip("-")) for x in self._orderings
+            ]
+            object_list = object_list.order_by(*self._orderings)
+
+        self.object_list = object_list
+
+    @staticmethod
+    def _seek_orderings(object_list):
+        opts = object_list.model._meta
+        query = object_list.query
+
+        orderings = list(query.order_by) or (list(opts.ordering) if query.default_ordering else [])
+
+        result = []
+        for ordering in orderings:
+            if not isinstance(ordering, six.string_types) or ordering == "?" or "__" in ordering:
+                raise ValueError("Ordering {!r} is not supported in seek mode".format(ordering))
+
+            descending = ordering.startswith("-")
+            name = ordering.lstrip("-")
+            if name == "pk":
+                name = opts.pk.name
+            result.append("-" + name if descending else name)
+
+        # The pk makes the ordering unique, it goes in the same direction as the last
+        # ordering so that single field orderings can use the built-in indexes
+        if opts.pk.name not in [x.lstrip("-") for x in result]:
+            descending = bool(result) and result[-1].startswith("-")
+            result.append("-" + opts.pk.name if descending else opts.pk.name)
+
+        return result
 
     def validate_number(self, number):
         """
@@ -44,7 +100,66 @@ class DatastorePaginator(object):
         has_next = len(fetched_objects) > self.per_page
         fetched_objects = fetched_objects[:self.per_page]
 
-        return DatastorePage(has_next, fetched_objects, number, self)
+        return self._make_page(has_next, fetched_objects, number)
+
+    def page_for_token(self, token):
+        """
+        Returns the Page for a `next_token` or `previous_token` of another page (or the
+        first page if `token` is empty). Rather than skipping over the results on the
+        previous pages, this queries for the results which come after (or before) the
+        page the token came from, so deep pages cost the same as the first.
+        """
+        if not self.seek:
+            raise ValueError("Page tokens are only supported in seek mode")
+
+        if not token:
+            return self.page(1)
+
+        try:
+            number, before, values = signing.loads(token, salt=self.TOKEN_SALT)
+            values = [field.to_python(value) for field, value in zip(self._fields, values)]
+        except (signing.BadSignature, TypeError, ValueError):
+            raise InvalidPage("That page token is not valid")
+
+        orderings = self._orderings
+        if before:
+            # Query backwards from the first result of the page the token came from
+            orderings = [x[1:] if x.startswith("-") else "-" + x for x in orderings]
+
+        query = seek_filter(self._fields, orderings, values)
+        if query is None:
+            queryset = self.object_list.none()
+        else:
+            queryset = self.object_list.order_by(*orderings).filter(query)
+
+        fetched_objects = list(queryset[:self.per_page + 1])
+        has_more = len(fetched_objects) > self.per_page
+        fetched_objects = fetched_objects[:self.per_page]
+
+        if before:
+            fetched_objects.reverse()
+            # If results have been deleted since the token was made, this may be the
+            # first page after all
+            return self._make_page(True, fetched_objects, number if has_more else 1)
+
+        return self._make_page(has_more, fetched_objects, self.validate_number(number))
+
+    def _make_token(self, instance, number, before):
+        values = [field.value_from_object(instance) for field in self._fields]
+        return signing.dumps(
+            [number, before, values], salt=self.TOKEN_SALT, serializer=_TokenSerializer, compress=True
+        )
+
+    def _make_page(self, has_next, object_list, number):
+        page = DatastorePage(has_next, object_list, number, self)
+
+        if self.seek and object_list:
+            if has_next:
+                page.next_token = self._make_token(object_list[-1], number + 1, False)
+            if number > 1:
+                page.previous_token = self._make_token(object_list[0], number - 1, True)
+
+        return page
 
     def _get_count(self):
         """
@@ -80,6 +195,11 @@ class DatastorePage(collections.Sequence):
         self.number = number
         self.paginator = paginator
 
+        # Opaque tokens for fetching the next and previous pages with
+        # paginator.page_for_token(), if the paginator is in seek mode
+        self.next_token = None
+        self.previous_token = None
+
     def __repr__(self):
         bottom = (self.number - 1) * self.paginator.per_page
         top = len(self.object_list)
@@ -3,3 +3,6 @@ from django.dispatch import Signal
 # Signals will only be fired when using GAE modules, not when autoscaling
 module_started = Signal(providing_args=['request'])
 module_stopped = Signal(providing_args=['request'])
+
+# Sent by djangae.test.TestCase before each test, so apps can reset any in-process state
+test_environment_reset = Signal()
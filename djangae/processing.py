@@ -1,3 +1,41 @@
+import functools
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
+
+from django.db import connections
+from django.db.models.query import QuerySet
+from gcloudc.db import transaction
+
+from djangae.utils import retry
+
+# The maximum number of entities that can be written in a single Datastore commit
+MAX_ENTITIES_PER_COMMIT = 500
+
+
+def close_thread_connections():
+    """
+        Closes the database connections opened by the current thread. Connections are
+        thread-local, so threads which are done with the database (e.g. pool workers)
+        have to do this themselves, as nothing else will.
+    """
+    connections.close_all()
+
+
+def closing_connections(function):
+    """
+        Wraps `function`, which is run on another thread, so that it calls
+        close_thread_connections when it returns.
+    """
+    @functools.wraps(function)
+    def wrapped(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_thread_connections()
+
+    return wrapped
 
 
 def _find_random_keys(queryset, shard_count):
@@ -10,6 +48,42 @@ def _find_random_keys(queryset, shard_count):
     )
 
 
+def _find_random_values(queryset, field, shard_count):
+    # Projecting the field in a __scatter__ query would need a composite index, so sample
+    # keys (which only needs the built-in index) and then fetch the instances by key
+    instances = queryset.model.objects.in_bulk(_find_random_keys(queryset, shard_count))
+
+    return [
+        value for value in (getattr(instance, field) for instance in instances.values())
+        if value is not None
+    ]
+
+
+def _ranges_from_samples(samples, shard_count):
+    """
+        Given a list of sampled values, return a list of (start, end) tuples
+        which split the sampled space into (at most) shard_count ranges.
+    """
+    samples = sorted(set(samples))
+
+    if not samples:
+        # No samples? Don't shard
+        return [(None, None)]
+
+    # We have enough samples to shard things
+    if len(samples) >= shard_count:
+        index_stride = len(samples) / float(shard_count)
+        split_points = [samples[int(round(index_stride * i))] for i in range(1, shard_count)]
+        # Rounding can land two shards on the same sample, which would give an empty range
+        split_points = sorted(set(split_points))
+    else:
+        split_points = samples
+
+    return [(None, split_points[0])] + [
+        (split_points[i], split_points[i + 1]) for i in range(len(split_points) - 1)
+    ] + [(split_points[-1], None)]
+
+
 def find_key_ranges_for_queryset(queryset, shard_count):
     """
         Given a queryset and a number of shard. This function makes use
@@ -19,26 +93,174 @@ def find_key_ranges_for_queryset(queryset, shard_count):
 
     if shard_count > 1:
         # Use the scatter property to generate shard points
-        random_keys = _find_random_keys(queryset, shard_count)
-
-        if not random_keys:
-            # No random keys? Don't shard
-            key_ranges = [(None, None)]
-        else:
-            random_keys.sort()
-
-            # We have enough random keys to shard things
-            if len(random_keys) >= shard_count:
-                index_stride = len(random_keys) / float(shard_count)
-                split_keys = [random_keys[int(round(index_stride * i))] for i in range(1, shard_count)]
-            else:
-                split_keys = random_keys
-
-            key_ranges = [(None, split_keys[0])] + [
-                (split_keys[i], split_keys[i + 1]) for i in range(len(split_keys) - 1)
-            ] + [(split_keys[-1], None)]
+        return _ranges_from_samples(_find_random_keys(queryset, shard_count), shard_count)
     else:
         # Don't shard
-        key_ranges = [(None, None)]
+        return [(None, None)]
+
+
+def find_ranges_for_field(queryset, field, shard_count):
+    """
+        Given a queryset, the name of an indexed field and a number of shards,
+        this function returns a list of (start, end) value ranges of that field
+        for sharded iteration.
+
+        Values are sampled using the __scatter__ property, and then restricted to
+        the range of values actually matched by the queryset, so that (for example)
+        a queryset of everything modified since a certain date is split evenly across
+        the modified dates, rather than across the whole key space.
+
+        Instances where the field is NULL are not included in any range.
+    """
+
+    if field == "pk":
+        return find_key_ranges_for_queryset(queryset, shard_count)
+
+    if shard_count <= 1:
+        # Don't shard
+        return [(None, None)]
+
+    queryset = queryset.exclude(**{"%s__isnull" % field: True})
+
+    lowest = queryset.order_by(field).values_list(field, flat=True).first()
+    highest = queryset.order_by("-%s" % field).values_list(field, flat=True).first()
+
+    if lowest is None or highest is None:
+        # Nothing to iterate? Don't shard
+        return [(None, None)]
+
+    samples = [
+        x for x in _find_random_values(queryset, field, shard_count)
+        if lowest < x <= highest
+    ]
+
+    return _ranges_from_samples(samples, shard_count)
+
+
+@closing_connections
+def _fetch_key_range(queryset, start, end, ordered):
+    filter_kwargs = {}
+    if start is not None:
+        filter_kwargs["pk__gte"] = start
+
+    if end is not None:
+        filter_kwargs["pk__lt"] = end
+
+    # calling order_by with no args to clear any pre-existing ordering (e.g. from Meta.ordering)
+    queryset = queryset.filter(**filter_kwargs).order_by()
+    if ordered:
+        queryset = queryset.order_by("pk")
+
+    return list(queryset)
+
+
+def parallel_iterate(queryset, shards=10, workers=None, ordered=False):
+    """
+        Synchronously iterates the queryset, splitting it into key ranges with
+        find_key_ranges_for_queryset and fetching each range concurrently on a
+        thread pool of `workers` threads (defaults to the number of shards).
+
+        Results are yielded a key range at a time, as each range arrives. If `ordered`
+        is True, results are yielded in key order instead (ranges are still fetched
+        concurrently, but are yielded in sequence). Any ordering on the queryset is
+        ignored.
+    """
+    key_ranges = find_key_ranges_for_queryset(queryset, shards)
+
+    executor = ThreadPoolExecutor(max_workers=workers or len(key_ranges))
+    futures = []
+    try:
+        futures = [
+            executor.submit(_fetch_key_range, queryset, start, end, ordered)
+            for start, end in key_ranges
+        ]
+
+        for future in (futures if ordered else as_completed(futures)):
+            for instance in future.result():
+                yield instance
+    finally:
+        # If the caller stopped iterating early, don't bother fetching what's left
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def _chunks(sequence, chunk_size):
+    sequence = list(sequence)
+    return [sequence[i:i + chunk_size] for i in range(0, len(sequence), chunk_size)]
+
+
+def _run_chunks(function, chunks, workers):
+    """
+        Calls `function` with each chunk on a pool of (at most) `workers` threads,
+        retrying each with backoff, and returns the results in the order of the chunks.
+    """
+    @closing_connections
+    def run(chunk):
+        return retry(function, chunk, _attempts=5)
+
+    if not chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        return list(executor.map(run, chunks))
+
+
+def bulk_delete(queryset_or_keys, model=None, batch_size=MAX_ENTITIES_PER_COMMIT, workers=4):
+    """
+        Deletes the instances matched by a queryset, or a list of instances or primary keys
+        (in which case `model` must be passed if they aren't instances), in chunks of
+        `batch_size` which are deleted concurrently on `workers` threads.
+
+        Querysets are only read keys-only. Returns the number of instances deleted.
+    """
+    if isinstance(queryset_or_keys, QuerySet):
+        model = queryset_or_keys.model
+        keys = queryset_or_keys.order_by().values_list("pk", flat=True)
+    else:
+        keys = []
+        for key in queryset_or_keys:
+            if hasattr(key, "_meta"):
+                model = model or type(key)
+                key = key.pk
+            keys.append(key)
+
+    if model is None:
+        if not keys:
+            return 0
+        raise ValueError("model must be passed when deleting by primary key")
+
+    def delete(chunk):
+        return model.objects.filter(pk__in=chunk).delete()[0]
+
+    return sum(_run_chunks(delete, _chunks(keys, batch_size), workers))
+
+
+def _save_chunk(instances, update_fields=None):
+    @transaction.atomic(xg=True)
+    def save():
+        for instance in instances:
+            instance.save(update_fields=update_fields)
+
+    save()
+    return len(instances)
+
+
+def bulk_save(instances, batch_size=MAX_ENTITIES_PER_COMMIT, workers=4):
+    """
+        Saves the instances in chunks of `batch_size`, where each chunk is written in a
+        single commit, and chunks are saved concurrently on `workers` threads.
+
+        Each chunk is saved atomically, but the chunks are not atomic with each other.
+    """
+    return sum(_run_chunks(_save_chunk, _chunks(instances, batch_size), workers))
+
+
+def bulk_update_fields(instances, fields, batch_size=MAX_ENTITIES_PER_COMMIT, workers=4):
+    """
+        The same as bulk_save, but only updates the given fields of each instance.
+    """
+    def update(chunk):
+        return _save_chunk(chunk, update_fields=fields)
 
-    return key_ranges
+    return sum(_run_chunks(update, _chunks(instances, batch_size), workers))
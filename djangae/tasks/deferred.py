@@ -28,7 +28,7 @@ from urllib.parse import unquote
 
 from djangae.environment import task_queue_name
 from djangae.models import DeferIterationMarker
-from djangae.processing import find_key_ranges_for_queryset
+from djangae.processing import find_ranges_for_field
 from djangae.utils import retry
 from django.conf import settings
 from django.db import models
@@ -276,7 +276,10 @@ class TimeoutException(Exception):
     pass
 
 
-def _process_shard(marker_id, shard_number, model, query, callback, finalize, buffer_time, args, kwargs):
+def _process_shard(
+    marker_id, shard_number, model, query, callback, finalize, buffer_time, args, kwargs, shard_on="pk",
+    resume_from=None
+):
     args = args or tuple()
 
     # Set an index of the shard in the environment, which is useful for callbacks
@@ -298,6 +301,8 @@ def _process_shard(marker_id, shard_number, model, query, callback, finalize, bu
             buffer_time=buffer_time,
             args=args,
             kwargs=kwargs,
+            shard_on=shard_on,
+            resume_from=resume_from,
             _queue=task_queue_name().rsplit("/", 1)[-1],
             _countdown=1
         )
@@ -306,14 +311,32 @@ def _process_shard(marker_id, shard_number, model, query, callback, finalize, bu
     try:
         qs = model.objects.all()
         qs.query = query
-        qs.order_by("pk")
+        if shard_on != "pk":
+            # Iterate in order of the shard field so that we can continue
+            # from the last value if we need to start a new shard
+            qs = qs.order_by(shard_on, "pk")
+
+        # When continuing a shard which was sharded on a field, `resume_from` is the value to continue
+        # from, and the pks of the instances with that value which have already been processed. Filtering
+        # on the pk as well would be an inequality on a second property, which the Datastore doesn't allow.
+        seen_value, seen = resume_from or (None, ())
+        seen = set(seen)
+        if seen_value is not None:
+            qs = qs.filter(**{"%s__gte" % shard_on: seen_value})
 
         calculate_buffer_time = buffer_time is None
         longest_iteration = 0
         longest_iteration_multiplier = 1.1
 
         last_pk = None
+        last_value = None
         for instance in qs.all():
+            if shard_on != "pk":
+                value = getattr(instance, shard_on)
+                if value == seen_value and instance.pk in seen:
+                    continue
+                last_value = value
+
             last_pk = instance.pk
 
             buffer_time_to_apply = (
@@ -332,6 +355,11 @@ def _process_shard(marker_id, shard_number, model, query, callback, finalize, bu
 
             callback(instance, *args, **kwargs)
 
+            if shard_on != "pk":
+                if last_value != seen_value:
+                    seen_value, seen = last_value, set()
+                seen.add(last_pk)
+
             iteration_end = time.time()
             iteration_time = iteration_end - iteration_start
 
@@ -381,27 +409,34 @@ def _process_shard(marker_id, shard_number, model, query, callback, finalize, bu
         else:
             logger.exception("Error processing shard. Retrying.")
 
-        if last_pk:
-            qs = qs.filter(pk__gte=last_pk)
+        if shard_on != "pk":
+            # Several instances can have the same value, so continue from the last value but skip
+            # the instances with that value which we've already processed
+            if last_pk is not None:
+                resume_from = (last_value, sorted(seen) if last_value == seen_value else [])
+        elif last_pk:
+            query = qs.filter(pk__gte=last_pk).query
 
         defer(
-            _process_shard, marker_id, shard_number, qs.model, qs.query, callback, finalize,
+            _process_shard, marker_id, shard_number, model, query, callback, finalize,
             buffer_time=buffer_time,
             args=args,
             kwargs=kwargs,
+            shard_on=shard_on,
+            resume_from=resume_from,
             _queue=task_queue_name().rsplit("/", 1)[-1],
             _countdown=1
         )
 
 
 def _generate_shards(
-    model, query, callback, finalize, args, kwargs, shards, delete_marker, buffer_time
+    model, query, callback, finalize, args, kwargs, shards, delete_marker, buffer_time, shard_on="pk"
 ):
 
     queryset = model.objects.all()
     queryset.query = query
 
-    key_ranges = find_key_ranges_for_queryset(queryset, shards)
+    key_ranges = find_ranges_for_field(queryset, shard_on, shards)
 
     marker = DeferIterationMarker.objects.create(
         delete_on_completion=delete_marker,
@@ -417,11 +452,11 @@ def _generate_shards(
         qs.query = query
 
         filter_kwargs = {}
-        if start:
-            filter_kwargs["pk__gte"] = start
+        if start is not None:
+            filter_kwargs["%s__gte" % shard_on] = start
 
-        if end:
-            filter_kwargs["pk__lt"] = end
+        if end is not None:
+            filter_kwargs["%s__lt" % shard_on] = end
 
         # calling order_by with no args to clear any pre-existing ordering (e.g. from Meta.ordering)
         qs = qs.filter(**filter_kwargs).order_by()
@@ -442,6 +477,7 @@ def _generate_shards(
                 args=args,
                 kwargs=kwargs,
                 buffer_time=buffer_time,
+                shard_on=shard_on,
                 _queue=task_queue_name().rsplit("/", 1)[-1],
                 _transactional=True
             )
@@ -455,7 +491,7 @@ def _generate_shards(
 
 def defer_iteration_with_finalize(
         queryset, callback, finalize, _queue='default', _shards=5,
-        _delete_marker=True, _transactional=False, _buffer_time=None, *args, **kwargs):
+        _delete_marker=True, _transactional=False, _buffer_time=None, _shard_on="pk", *args, **kwargs):
 
     defer(
         _generate_shards,
@@ -468,6 +504,7 @@ def defer_iteration_with_finalize(
         delete_marker=_delete_marker,
         shards=_shards,
         buffer_time=_buffer_time,
+        shard_on=_shard_on,
         _queue=_queue,
         _transactional=_transactional
     )
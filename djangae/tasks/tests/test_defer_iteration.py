@@ -1,7 +1,9 @@
 import os
+import time
 
 from django.db import models
 
+from djangae.contrib import sleuth
 from djangae.tasks.deferred import (
     DEFERRED_ITERATION_SHARD_INDEX_KEY,
     defer_iteration_with_finalize,
@@ -15,6 +17,7 @@ class DeferIterationTestModel(models.Model):
     touched = models.BooleanField(default=False)
     finalized = models.BooleanField(default=False)
     ignored = models.BooleanField(default=False)
+    sequence = models.IntegerField(default=0)
 
 
 def callback(instance, touch=True):
@@ -43,6 +46,17 @@ def sporadic_error(instance):
     instance.save()
 
 
+processed_pks = []
+
+
+def slow_callback(instance):
+    processed_pks.append(instance.pk)
+    time.sleep(0.02)
+
+    instance.touched = True
+    instance.save()
+
+
 def finalize(touch=True):
     for instance in DeferIterationTestModel.objects.all():
         instance.finalized = True
@@ -113,3 +127,62 @@ class DeferIterationTestCase(TestCase):
 
         self.assertEqual(25, DeferIterationTestModel.objects.filter(touched=True).count())
         self.assertEqual(25, DeferIterationTestModel.objects.filter(finalized=True).count())
+
+    def test_shard_on_field(self):
+        [DeferIterationTestModel.objects.create(sequence=i) for i in range(25)]
+
+        defer_iteration_with_finalize(
+            DeferIterationTestModel.objects.filter(sequence__gte=10),
+            callback,
+            finalize,
+            _shards=_SHARD_COUNT,
+            _shard_on="sequence"
+        )
+
+        self.process_task_queues()
+
+        self.assertEqual(15, DeferIterationTestModel.objects.filter(touched=True).count())
+        self.assertEqual(0, DeferIterationTestModel.objects.filter(touched=True, sequence__lt=10).count())
+        self.assertEqual(25, DeferIterationTestModel.objects.filter(finalized=True).count())
+
+    def test_shard_on_field_continues_after_timeout(self):
+        # All the instances have the same value, so continuing from the last value would
+        # start the shard again from the beginning
+        [DeferIterationTestModel.objects.create(pk=i + 1, sequence=1) for i in range(10)]
+        del processed_pks[:]
+
+        with sleuth.switch("djangae.tasks.deferred._TASK_TIME_LIMIT", 0.05):
+            defer_iteration_with_finalize(
+                DeferIterationTestModel.objects.all(),
+                slow_callback,
+                finalize,
+                _shards=1,
+                _buffer_time=0,
+                _shard_on="sequence"
+            )
+
+            self.process_task_queues()
+
+        self.assertEqual(list(range(1, 11)), processed_pks)
+        self.assertEqual(10, DeferIterationTestModel.objects.filter(touched=True).count())
+        self.assertEqual(10, DeferIterationTestModel.objects.filter(finalized=True).count())
+
+    def test_sharded_on_field_continues_after_timeout(self):
+        # Each shard has a range of values, so continuing mustn't add a second inequality (on the pk)
+        [DeferIterationTestModel.objects.create(pk=i + 1, sequence=i // 5) for i in range(20)]
+        del processed_pks[:]
+
+        with sleuth.switch("djangae.tasks.deferred._TASK_TIME_LIMIT", 0.05):
+            defer_iteration_with_finalize(
+                DeferIterationTestModel.objects.all(),
+                slow_callback,
+                finalize,
+                _shards=2,
+                _buffer_time=0,
+                _shard_on="sequence"
+            )
+
+            self.process_task_queues()
+
+        self.assertEqual(list(range(1, 21)), sorted(processed_pks))
+        self.assertEqual(20, DeferIterationTestModel.objects.filter(touched=True).count())
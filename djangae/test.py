@@ -7,6 +7,7 @@ from djangae.tasks.test import (
 )
 from django import test
 from django.core.cache import cache
+from djangae.core.signals import test_environment_reset
 from djangae.sandbox import start_emulators, stop_emulators
 
 
@@ -17,6 +18,7 @@ TaskFailedBehaviour = TaskFailedBehaviour
 class TestEnvironmentMixin(object):
     def setUp(self):
         cache.clear()
+        test_environment_reset.send(sender=self.__class__)
         super().setUp()
 
 
@@ -2,6 +2,7 @@
     Tests for djangae.core.paginator to make sure that never does a full
     count on a query.
 """
+from django.core.paginator import InvalidPage
 from django.db import models
 from django.utils.six.moves import range
 
@@ -69,3 +70,60 @@ class PaginatorTests(TestCase):
 
         self.assertEqual(page[0].field1, 4)
         self.assertEqual(page[1].field1, 5)
+
+
+class SeekPaginatorTests(TestCase):
+    def setUp(self):
+        super(SeekPaginatorTests, self).setUp()
+
+        # field1 has duplicates, so the pk has to be used to order within them
+        self.instances = [
+            SimplePaginatedModel.objects.create(field1=x // 2, field2=str(x))
+            for x in range(7)
+        ]
+
+    def test_tokens(self):
+        paginator = Paginator(SimplePaginatedModel.objects.all(), 2, seek=True)
+
+        page = paginator.page_for_token(None)
+        self.assertIsNone(page.previous_token)
+        pages = [list(page)]
+
+        while page.next_token:
+            page = paginator.page_for_token(page.next_token)
+            pages.append(list(page))
+
+        self.assertEqual(4, page.number)
+        self.assertFalse(page.has_next())
+        self.assertEqual(
+            [self.instances[i:i + 2] for i in range(0, 7, 2)],
+            pages
+        )
+
+        # And back again
+        while page.previous_token:
+            page = paginator.page_for_token(page.previous_token)
+            self.assertEqual(pages[page.number - 1], list(page))
+            self.assertTrue(page.has_next())
+
+        self.assertEqual(1, page.number)
+        self.assertFalse(page.has_previous())
+
+    def test_descending_ordering(self):
+        paginator = Paginator(SimplePaginatedModel.objects.order_by("-field1"), 3, seek=True)
+
+        page = paginator.page(1)
+        self.assertEqual(self.instances[::-1][:3], list(page))
+
+        page = paginator.page_for_token(page.next_token)
+        self.assertEqual(self.instances[::-1][3:6], list(page))
+
+    def test_invalid_token(self):
+        paginator = Paginator(SimplePaginatedModel.objects.all(), 2, seek=True)
+        token = paginator.page(1).next_token
+
+        with self.assertRaises(InvalidPage):
+            paginator.page_for_token(token[:-1] + ("A" if token[-1] != "A" else "B"))
+
+        with self.assertRaises(ValueError):
+            Paginator(SimplePaginatedModel.objects.all(), 2).page_for_token(token)
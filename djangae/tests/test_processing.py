@@ -0,0 +1,114 @@
+from django.db import models
+
+from djangae.processing import (
+    bulk_delete,
+    bulk_save,
+    bulk_update_fields,
+    find_key_ranges_for_queryset,
+    find_ranges_for_field,
+    parallel_iterate,
+)
+from djangae.test import TestCase
+
+
+class ProcessingTestModel(models.Model):
+    sequence = models.IntegerField(null=True)
+
+    class Meta:
+        app_label = "djangae"
+
+
+class FindRangesForFieldTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        [ProcessingTestModel.objects.create(sequence=i) for i in range(100)]
+
+    def test_pk_uses_key_ranges(self):
+        queryset = ProcessingTestModel.objects.all()
+        self.assertEqual(
+            len(find_key_ranges_for_queryset(queryset, 1)),
+            len(find_ranges_for_field(queryset, "pk", 1))
+        )
+
+    def test_ranges_cover_queryset(self):
+        queryset = ProcessingTestModel.objects.filter(sequence__gte=50)
+        ranges = find_ranges_for_field(queryset, "sequence", 5)
+
+        self.assertEqual(ranges[0][0], None)
+        self.assertEqual(ranges[-1][1], None)
+
+        # Every split point should be within the values matched by the queryset
+        for start, end in ranges[1:]:
+            self.assertTrue(50 < start < 100)
+
+        total = 0
+        for start, end in ranges:
+            qs = queryset
+            if start is not None:
+                qs = qs.filter(sequence__gte=start)
+            if end is not None:
+                qs = qs.filter(sequence__lt=end)
+            total += qs.count()
+
+        self.assertEqual(50, total)
+
+    def test_no_sharding_for_single_shard(self):
+        queryset = ProcessingTestModel.objects.all()
+        self.assertEqual([(None, None)], find_ranges_for_field(queryset, "sequence", 1))
+
+    def test_empty_queryset(self):
+        queryset = ProcessingTestModel.objects.filter(sequence__gte=1000)
+        self.assertEqual([(None, None)], find_ranges_for_field(queryset, "sequence", 5))
+
+
+class ParallelIterateTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.instances = [ProcessingTestModel.objects.create(sequence=i) for i in range(50)]
+
+    def test_all_instances_returned(self):
+        results = list(parallel_iterate(ProcessingTestModel.objects.all(), shards=5, workers=3))
+        self.assertCountEqual([x.pk for x in self.instances], [x.pk for x in results])
+
+    def test_filters_respected(self):
+        results = list(parallel_iterate(ProcessingTestModel.objects.filter(sequence__lt=10), shards=5))
+        self.assertCountEqual(list(range(10)), [x.sequence for x in results])
+
+    def test_ordered(self):
+        results = list(parallel_iterate(ProcessingTestModel.objects.all(), shards=5, ordered=True))
+        self.assertEqual(sorted(x.pk for x in self.instances), [x.pk for x in results])
+
+
+class BulkMutationTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.instances = [ProcessingTestModel.objects.create(sequence=i) for i in range(20)]
+
+    def test_bulk_delete_queryset(self):
+        deleted = bulk_delete(ProcessingTestModel.objects.filter(sequence__lt=10), batch_size=3)
+        self.assertEqual(10, deleted)
+        self.assertEqual(10, ProcessingTestModel.objects.count())
+        self.assertFalse(ProcessingTestModel.objects.filter(sequence__lt=10).exists())
+
+    def test_bulk_delete_instances_and_keys(self):
+        bulk_delete(self.instances[:5], batch_size=2)
+        self.assertEqual(15, ProcessingTestModel.objects.count())
+
+        bulk_delete([x.pk for x in self.instances[5:10]], model=ProcessingTestModel, batch_size=2)
+        self.assertEqual(10, ProcessingTestModel.objects.count())
+
+        self.assertRaises(ValueError, bulk_delete, [self.instances[10].pk])
+
+    def test_bulk_save(self):
+        for instance in self.instances:
+            instance.sequence += 100
+
+        self.assertEqual(20, bulk_save(self.instances, batch_size=3))
+        self.assertEqual(20, ProcessingTestModel.objects.filter(sequence__gte=100).count())
+
+    def test_bulk_update_fields(self):
+        for instance in self.instances:
+            instance.sequence = None
+
+        self.assertEqual(20, bulk_update_fields(self.instances, ["sequence"], batch_size=7))
+        self.assertEqual(20, ProcessingTestModel.objects.filter(sequence__isnull=True).count())
@@ -1,7 +1,7 @@
 from django.db import models
 from djangae.contrib import sleuth
 from djangae.test import TestCase
-from djangae.utils import get_next_available_port, retry, retry_on_error
+from djangae.utils import get_in_batches, get_next_available_port, retry, retry_on_error
 from django.utils.encoding import python_2_unicode_compatible
 
 
@@ -29,6 +29,48 @@ class EnsureCreatedModel(models.Model):
         return u"PK: {}, field1 {}".format(self.pk, self.field1)
 
 
+class GetInBatchesTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # Include duplicate values of field1 to check keyset batching with non-unique orderings
+        self.instances = [EnsureCreatedModel.objects.create(field1=i // 3) for i in range(25)]
+
+    def test_offset_batches(self):
+        results = list(get_in_batches(EnsureCreatedModel.objects.order_by("pk"), batch_size=4))
+        self.assertEqual(sorted(x.pk for x in self.instances), [x.pk for x in results])
+
+    def test_keyset_batches_on_pk(self):
+        results = list(get_in_batches(EnsureCreatedModel.objects.all(), batch_size=4, keyset=True))
+        self.assertEqual(sorted(x.pk for x in self.instances), [x.pk for x in results])
+
+        results = list(get_in_batches(EnsureCreatedModel.objects.order_by("-pk"), batch_size=4, keyset=True))
+        self.assertEqual(sorted((x.pk for x in self.instances), reverse=True), [x.pk for x in results])
+
+    def test_keyset_batches_on_non_unique_field(self):
+        for batch_size in (1, 2, 3, 4, 10):
+            results = list(
+                get_in_batches(EnsureCreatedModel.objects.order_by("field1"), batch_size=batch_size, keyset=True)
+            )
+            self.assertCountEqual([x.pk for x in self.instances], [x.pk for x in results])
+            self.assertEqual(sorted(x.field1 for x in results), [x.field1 for x in results])
+
+            results = list(
+                get_in_batches(EnsureCreatedModel.objects.order_by("-field1"), batch_size=batch_size, keyset=True)
+            )
+            self.assertCountEqual([x.pk for x in self.instances], [x.pk for x in results])
+
+    def test_keyset_batches_with_multiple_orderings(self):
+        queryset = EnsureCreatedModel.objects.order_by("field1", "pk")
+        self.assertRaises(ValueError, list, get_in_batches(queryset, keyset=True))
+
+    def test_prefetch(self):
+        for keyset in (False, True):
+            results = list(
+                get_in_batches(EnsureCreatedModel.objects.order_by("pk"), batch_size=4, keyset=keyset, prefetch=True)
+            )
+            self.assertEqual(sorted(x.pk for x in self.instances), [x.pk for x in results])
+
+
 class RetryTestCase(TestCase):
     """ Tests for djangae.utils.retry.
         We test the retry_on_error decorator because it tests `retry` by proxy.
@@ -7,6 +7,7 @@ import random
 import sys
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from socket import socket
 
 
@@ -78,22 +79,159 @@ def in_testing():
     return "test" in sys.argv
 
 
-def get_in_batches(queryset, batch_size=10):
-    """ prefetches the queryset in batches """
+def seek_filter(fields, orderings, values):
+    """
+    Returns a Q which matches the results that come after `values` (the values
+    of `fields`) in the given `orderings`, or None if nothing can come after them.
+
+    This is an OR of a branch for each field, where the previous fields are equal
+    to their values and the field itself comes after its value.
+    """
+    from django.db.models import Q
+
+    query = None
+    for i, ordering in enumerate(orderings):
+        descending = ordering.startswith("-")
+        name = ordering.lstrip("-")
+        value = values[i]
+
+        branch = {}
+        for previous_field, previous_value in zip(fields[:i], values[:i]):
+            if previous_value is None:
+                branch["{}__isnull".format(previous_field.name)] = True
+            else:
+                branch[previous_field.name] = previous_value
+
+        if value is None:
+            if descending:
+                # Nothing comes after None in a descending ordering
+                continue
+            branch["{}__isnull".format(name)] = False
+        else:
+            branch["{}__{}".format(name, "lt" if descending else "gt")] = value
+
+        query = Q(**branch) if query is None else query | Q(**branch)
+
+    return query
+
+
+def _offset_batches(queryset, batch_size):
     start = 0
-    if batch_size < 1:
-        raise Exception("batch_size must be > 0")
     end = batch_size
     while True:
         batch = [x for x in queryset[start:end]]
-        for y in batch:
-            yield y
+        yield batch
         if len(batch) < batch_size:
             break
         start += batch_size
         end += batch_size
 
 
+def _keyset_ordering(queryset):
+    """ Returns the (field, descending) pair that a queryset is ordered on, for keyset batching """
+    ordering = queryset.query.order_by
+    if not ordering and queryset.query.default_ordering:
+        ordering = queryset.model._meta.ordering
+
+    ordering = list(ordering) or ["pk"]
+    if len(ordering) > 1 or not isinstance(ordering[0], str) or ordering[0] == "?":
+        raise ValueError("Keyset batching is only supported for querysets ordered on a single field")
+
+    field = ordering[0]
+    descending = field.startswith("-")
+    field = field.lstrip("-")
+    if field == queryset.model._meta.pk.name:
+        field = "pk"
+
+    return field, descending
+
+
+def _keyset_batches(queryset, batch_size):
+    field, descending = _keyset_ordering(queryset)
+    lookup = "%s__%s" % (field, "lte" if descending else "gte")
+
+    if field == "pk":
+        lookup = "pk__lt" if descending else "pk__gt"
+        queryset = queryset.order_by("-pk" if descending else "pk")
+    else:
+        # Order on the pk too so that iteration over instances with equal values is stable
+        queryset = queryset.order_by(
+            "-%s" % field if descending else field,
+            "-pk" if descending else "pk"
+        )
+
+    last_value = None
+    # pks of the instances we've already returned which have a value of last_value. The
+    # field may not be unique, so we continue from (and including) the last value and skip these.
+    seen = set()
+    while True:
+        qs = queryset
+        if last_value is not None:
+            qs = qs.filter(**{lookup: last_value})
+
+        batch = [x for x in qs[:batch_size + len(seen)] if x.pk not in seen][:batch_size]
+        yield batch
+        if len(batch) < batch_size:
+            break
+
+        value = batch[-1].pk if field == "pk" else getattr(batch[-1], field)
+        if field != "pk" and value is None:
+            raise ValueError("Keyset batching doesn't support None values in the ordering field")
+
+        if value != last_value:
+            seen = set()
+
+        last_value = value
+        seen.update(x.pk for x in batch if field != "pk" and getattr(x, field) == value)
+
+
+def _prefetch_batches(batches):
+    """ Fetches the next batch in a background thread while the current one is consumed """
+    from djangae.processing import close_thread_connections
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(next, batches, None)
+        while True:
+            batch = future.result()
+            if batch is None:
+                break
+
+            future = executor.submit(next, batches, None)
+            yield batch
+    finally:
+        # The worker thread opened its own connection to fetch the batches
+        executor.submit(close_thread_connections)
+        executor.shutdown(wait=False)
+
+
+def get_in_batches(queryset, batch_size=10, keyset=False, prefetch=False):
+    """ prefetches the queryset in batches
+
+        If `keyset` is True, each batch continues from the last value of the queryset's
+        ordering (which must be a single field, or the pk), rather than slicing with an
+        increasing offset. On the Datastore skipped offset entities are still read, so this
+        is much cheaper for large querysets.
+
+        If `prefetch` is True, the next batch is fetched in a background thread while the
+        current batch is being iterated.
+    """
+    if batch_size < 1:
+        raise Exception("batch_size must be > 0")
+
+    if keyset:
+        batches = _keyset_batches(queryset, batch_size)
+    else:
+        batches = _offset_batches(queryset, batch_size)
+
+    if prefetch:
+        batches = _prefetch_batches(batches)
+
+    for batch in batches:
+        for y in batch:
+            yield y
+
+
 def retry_until_successful(func, *args, **kwargs):
     return retry(func, *args, _attempts=float('inf'), **kwargs)
 
@@ -77,7 +77,16 @@ def deferred(request):
 def clearsessions(request):
     engine = import_module(settings.SESSION_ENGINE)
     try:
-        engine.SessionStore.clear_expired()
+        if hasattr(engine.SessionStore, "get_model_class"):
+            # Database backed sessions, delete them in concurrent batches rather than
+            # a single queryset delete
+            from django.utils import timezone
+            from djangae.processing import bulk_delete
+
+            model = engine.SessionStore.get_model_class()
+            bulk_delete(model.objects.filter(expire_date__lt=timezone.now()))
+        else:
+            engine.SessionStore.clear_expired()
     except NotImplementedError:
         logger.exception(
             "Session engine '%s' doesn't support clearing "